@@ -0,0 +1,92 @@
+import json
+import os
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+
+# Pool / timeout settings for the connection to the model backend
+BACKEND_POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "100"))
+BACKEND_KEEPALIVE = int(os.getenv("BACKEND_KEEPALIVE", "20"))
+BACKEND_KEEPALIVE_EXPIRY = float(os.getenv("BACKEND_KEEPALIVE_EXPIRY", "30"))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "2"))
+BACKEND_READ_TIMEOUT = float(os.getenv("BACKEND_READ_TIMEOUT", "60"))
+
+
+class BackendClient:
+    """Shared keep-alive HTTP client for talking to Ollama.
+
+    One instance is created on startup and reused by every request, so
+    connections stay in the pool instead of being opened per call.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        pool_size: int = BACKEND_POOL_SIZE,
+        keepalive: int = BACKEND_KEEPALIVE,
+        connect_timeout: float = BACKEND_CONNECT_TIMEOUT,
+        read_timeout: float = BACKEND_READ_TIMEOUT,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._limits = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=keepalive,
+            keepalive_expiry=BACKEND_KEEPALIVE_EXPIRY,
+        )
+
+    def _timeout(self, read_timeout: Optional[float] = None) -> httpx.Timeout:
+        read = self.read_timeout if read_timeout is None else read_timeout
+        return httpx.Timeout(read, connect=self.connect_timeout)
+
+    async def start(self):
+        self._ensure_client()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        # building the client does no I/O, so it is safe to do lazily in a request
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=self._limits,
+                timeout=self._timeout(),
+                headers={"Content-Type": "application/json"},
+            )
+        return self._client
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._ensure_client()
+
+    async def generate(self, payload: Dict, read_timeout: Optional[float] = None) -> Dict:
+        response = await self.client.post(
+            "/api/generate",
+            json=payload,
+            timeout=self._timeout(read_timeout),
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def stream_generate(self, payload: Dict, read_timeout: Optional[float] = None) -> AsyncIterator[Dict]:
+        # Ollama streams one JSON object per line, the last one has done=true
+        async with self.client.stream(
+            "POST",
+            "/api/generate",
+            json={**payload, "stream": True},
+            timeout=self._timeout(read_timeout),
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+    async def version(self, timeout: float = 5.0) -> httpx.Response:
+        return await self.client.get("/api/version", timeout=self._timeout(timeout))
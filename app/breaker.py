@@ -0,0 +1,100 @@
+import os
+import time
+from collections import deque
+
+from app.metrics import CIRCUIT_BREAKER_STATE, CIRCUIT_BREAKER_TRANSITIONS
+
+
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_REQUESTS = int(os.getenv("BREAKER_MIN_REQUESTS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "15"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Per-backend breaker over the last `window` call outcomes.
+
+    Opens when at least min_requests outcomes are recorded and the share of
+    failures (errors and timeouts) reaches failure_rate. While open, no
+    traffic is sent. After open_seconds it goes half-open and lets
+    half_open_probes real requests through: a success closes it, a failure
+    opens it again.
+    """
+
+    def __init__(
+        self,
+        backend_id: str,
+        window: int = BREAKER_WINDOW,
+        min_requests: int = BREAKER_MIN_REQUESTS,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        open_seconds: float = BREAKER_OPEN_SECONDS,
+        half_open_probes: int = BREAKER_HALF_OPEN_PROBES,
+    ):
+        self.backend_id = backend_id
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self._outcomes = deque(maxlen=window)
+        CIRCUIT_BREAKER_STATE.labels(backend=backend_id).set(0)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if state != HALF_OPEN:
+            self.probes_in_flight = 0
+        if state == CLOSED:
+            self._outcomes.clear()
+        CIRCUIT_BREAKER_STATE.labels(backend=self.backend_id).set(_STATE_VALUE[state])
+        CIRCUIT_BREAKER_TRANSITIONS.labels(backend=self.backend_id, state=state).inc()
+
+    def available(self) -> bool:
+        """Whether a request could be sent now; does not change state."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.open_seconds
+        return self.probes_in_flight < self.half_open_probes
+
+    def acquire(self):
+        """Called once the backend is picked for a request."""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            self.probes_in_flight += 1
+
+    def release(self):
+        # request cancelled before an outcome, e.g. the losing side of a hedge
+        if self.state == HALF_OPEN and self.probes_in_flight > 0:
+            self.probes_in_flight -= 1
+
+    def record_success(self):
+        if self.state == HALF_OPEN:
+            self._transition(CLOSED)
+            return
+        self._outcomes.append(0)
+
+    def record_failure(self):
+        if self.state == HALF_OPEN:
+            self._transition(OPEN)
+            return
+        if self.state == OPEN:
+            return
+        self._outcomes.append(1)
+        if len(self._outcomes) >= self.min_requests and \
+                sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+            self._transition(OPEN)
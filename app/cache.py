@@ -0,0 +1,103 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app.metrics import CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES, CACHE_SIZE_BYTES
+
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+# only settings at or below this temperature are treated as deterministic
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", "0.3"))
+RESPONSE_CACHE_TEMPERATURE_BUCKET = float(os.getenv("RESPONSE_CACHE_TEMPERATURE_BUCKET", "0.1"))
+# whether hits still cost the user money / count against the rate limit
+RESPONSE_CACHE_CHARGE_COST = os.getenv("RESPONSE_CACHE_CHARGE_COST", "true").lower() == "true"
+RESPONSE_CACHE_BYPASS_RATE_LIMIT = os.getenv("RESPONSE_CACHE_BYPASS_RATE_LIMIT", "false").lower() == "true"
+
+_WHITESPACE = re.compile(r"\s+")
+
+CacheKey = Tuple[str, str, int, int]
+
+
+class ResponseCache:
+    """LRU + TTL cache of generated text with an entry and byte cap."""
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+        max_temperature: float = RESPONSE_CACHE_MAX_TEMPERATURE,
+        temperature_bucket: float = RESPONSE_CACHE_TEMPERATURE_BUCKET,
+        enabled: bool = RESPONSE_CACHE_ENABLED,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_temperature = max_temperature
+        self.temperature_bucket = temperature_bucket
+        self.enabled = enabled
+
+        # key -> (expires_at, size, text)
+        self._entries: "OrderedDict[CacheKey, Tuple[float, int, str]]" = OrderedDict()
+        self.size_bytes = 0
+
+    def cacheable(self, temperature: float) -> bool:
+        return self.enabled and temperature <= self.max_temperature
+
+    def make_key(self, model: str, prompt: str, max_tokens: int, temperature: float) -> CacheKey:
+        normalized = _WHITESPACE.sub(" ", prompt.strip())
+        bucket = int(round(temperature / self.temperature_bucket)) if self.temperature_bucket > 0 else 0
+        return (model, normalized, int(max_tokens), bucket)
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            CACHE_MISSES.inc()
+            return None
+
+        expires_at, _, text = entry
+        if expires_at < time.monotonic():
+            self._remove(key, "ttl")
+            CACHE_MISSES.inc()
+            return None
+
+        self._entries.move_to_end(key)
+        CACHE_HITS.inc()
+        return text
+
+    def put(self, key: CacheKey, text: str):
+        size = len(key[1].encode()) + len(text.encode())
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key, None)
+
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, size, text)
+        self.size_bytes += size
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)), "lru")
+        while self.size_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)), "size")
+        CACHE_SIZE_BYTES.set(self.size_bytes)
+
+    def _remove(self, key: CacheKey, reason: Optional[str]):
+        _, size, _ = self._entries.pop(key)
+        self.size_bytes -= size
+        if reason:
+            CACHE_EVICTIONS.labels(reason=reason).inc()
+        CACHE_SIZE_BYTES.set(self.size_bytes)
+
+    def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
+        CACHE_SIZE_BYTES.set(0)
+
+
+response_cache = ResponseCache()
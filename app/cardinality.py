@@ -0,0 +1,241 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+
+METRICS_TOP_USERS = int(os.getenv("METRICS_TOP_USERS", "100"))
+# a user that took over an evicted user's count only gets its own series after
+# this many guaranteed requests; until then its increments go to OTHER_USER
+METRICS_USER_MIN_REQUESTS = int(os.getenv("METRICS_USER_MIN_REQUESTS", "5"))
+# pending counter increments are applied after this many, and on every scrape
+METRICS_FLUSH_EVERY = int(os.getenv("METRICS_FLUSH_EVERY", "256"))
+# ... and at least this often, so an idle worker's counts still show up
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "1"))
+
+OTHER_USER = "other"
+
+
+class TopUsers:
+    """Space-Saving heavy-hitter tracker for the `user` label.
+
+    Keeps counts for at most k users. A new user arriving when full replaces
+    the user with the lowest count and inherits that count as its error, so
+    count - error is a lower bound on its real request count. Users with an
+    exact count (no error) are labelled by name from their first request,
+    users with an inherited count once their lower bound reaches min_count,
+    so the long tail doesn't churn series; until then they are OTHER_USER.
+    on_promote is called when a user gets its name, on_evict(user, labelled)
+    when a user is pushed out, so counts can be moved and series
+    dropped. That keeps the series count at most k per label combination.
+
+    Only touched from the event loop, so there is no lock.
+    """
+
+    def __init__(self, k: int = METRICS_TOP_USERS, min_count: int = METRICS_USER_MIN_REQUESTS,
+                 on_promote=None, on_evict=None):
+        self.k = k
+        self.min_count = min_count
+        self.on_promote = on_promote
+        self.on_evict = on_evict
+        self._counts: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+        self._labelled: Set[str] = set()
+
+    def observe(self, user: str) -> str:
+        counts = self._counts
+        if user in counts:
+            counts[user] += 1
+        elif len(counts) < self.k:
+            counts[user] = 1
+            self._errors[user] = 0
+        else:
+            victim = min(counts, key=counts.get)
+            floor = counts.pop(victim)
+            del self._errors[victim]
+            labelled = victim in self._labelled
+            self._labelled.discard(victim)
+            if self.on_evict is not None:
+                self.on_evict(victim, labelled)
+            counts[user] = floor + 1
+            self._errors[user] = floor
+
+        if user in self._labelled:
+            return user
+        error = self._errors[user]
+        if not error or counts[user] - error >= self.min_count:
+            self._labelled.add(user)
+            if self.on_promote is not None:
+                self.on_promote(user)
+            return user
+        return OTHER_USER
+
+    def label(self, user: str) -> str:
+        # label for a user without counting a request
+        return user if user in self._labelled else OTHER_USER
+
+    def top(self) -> List[Tuple[str, int]]:
+        return sorted(((u, self._counts[u]) for u in self._labelled), key=lambda item: -item[1])
+
+
+class MetricsRecorder:
+    """Hot path for request metrics.
+
+    Label children are resolved once and cached, so a request costs a dict
+    lookup per metric instead of a .labels() call (label validation, a lock
+    and a dict lookup inside the metric). Counter increments are summed in a
+    pending dict and applied in bulk every flush_every updates and before
+    each scrape; histograms and gauges are written straight to their cached
+    child. The user label goes through TopUsers, so per-user series stay
+    bounded no matter how many users there are. Increments of a user that
+    TopUsers still reports as OTHER_USER go to OTHER_USER right away; the
+    ones not flushed yet move to the user's own series when it is promoted
+    (a counter can't go back down, so flushed ones stay). A named user that
+    is pushed out has its totals folded into OTHER_USER before its series
+    are removed, so the sum over all series is always the requests served.
+
+    In multiprocess mode series can't be removed from the mmap files, so
+    drop_series is off there and evicted users stay in the files until the
+    directory is emptied on the next deploy. The merged /metrics output is
+    capped at render time instead, see app/exposition.py.
+    """
+
+    def __init__(self, request_count, request_latency, input_tokens, output_tokens, tokens_per_second,
+                 top_k: int = METRICS_TOP_USERS, min_requests: int = METRICS_USER_MIN_REQUESTS,
+                 flush_every: int = METRICS_FLUSH_EVERY, flush_seconds: float = METRICS_FLUSH_SECONDS,
+                 drop_series: bool = True):
+        self.request_count = request_count
+        self.request_latency = request_latency
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.tokens_per_second = tokens_per_second
+        self.users = TopUsers(top_k, min_requests, on_promote=self._promote_user, on_evict=self._drop_user)
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.drop_series = drop_series
+
+        self._children: Dict[tuple, object] = {}
+        self._user_series: Dict[str, List[tuple]] = {}
+        self._pending: Dict[object, float] = {}
+        # (metric, label values) -> total of a named user's series, folded into OTHER_USER on eviction
+        self._totals: Dict[tuple, float] = {}
+        # user -> {(metric, label values with OTHER_USER): amount} put in OTHER_USER since the last flush
+        self._unflushed: Dict[str, Dict[tuple, float]] = {}
+        self._pending_updates = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _child(self, metric, values: tuple, user: str = OTHER_USER):
+        key = (metric, values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = metric.labels(*values)
+            if user != OTHER_USER:
+                self._user_series.setdefault(user, []).append(key)
+        return child
+
+    def _inc_user(self, metric, values: tuple, user: str, label: str, amount: float):
+        key = (metric, values)
+        if label == OTHER_USER:
+            unflushed = self._unflushed.setdefault(user, {})
+            unflushed[key] = unflushed.get(key, 0) + amount
+        else:
+            self._totals[key] = self._totals.get(key, 0) + amount
+        self._inc(self._child(metric, values, label), amount)
+
+    def _inc(self, child, amount: float):
+        self._pending[child] = self._pending.get(child, 0) + amount
+        self._pending_updates += 1
+        if self._pending_updates >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        pending, self._pending = self._pending, {}
+        self._pending_updates = 0
+        self._unflushed = {}
+        for child, amount in pending.items():
+            child.inc(amount)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            self.flush()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
+    @staticmethod
+    def _with_user(metric, values: tuple, user: str) -> tuple:
+        i = metric._labelnames.index("user")
+        return values[:i] + (user,) + values[i + 1:]
+
+    def _promote_user(self, user: str):
+        moved = self._unflushed.pop(user, {})
+        # take everything back out of pending first: an _inc below may flush
+        for key, amount in moved.items():
+            other = self._children[key]
+            left = self._pending[other] - amount
+            if left > 0:
+                self._pending[other] = left
+            else:
+                del self._pending[other]
+        for (metric, values), amount in moved.items():
+            self._inc_user(metric, self._with_user(metric, values, user), user, user, amount)
+
+    def _drop_user(self, user: str, labelled: bool):
+        if not labelled:
+            self._unflushed.pop(user, None)
+            return
+        # no flush here: it would pin other users' unflushed increments in OTHER_USER
+        for metric, values in self._user_series.pop(user, ()):
+            child = self._children.pop((metric, values))
+            pending = self._pending.pop(child, 0)
+            total = self._totals.pop((metric, values), 0)
+            if not self.drop_series:
+                # the series stays in the mmap files, folding it would count it twice
+                if pending:
+                    child.inc(pending)
+                continue
+            if total:
+                self._inc(self._child(metric, self._with_user(metric, values, OTHER_USER)), total)
+            try:
+                metric.remove(*values)
+            except KeyError:
+                pass
+
+    def user_label(self, user: str) -> str:
+        return self.users.label(user)
+
+    def count_user(self, metric, user: str, amount: float = 1, **labels):
+        """Increment a counter with a `user` label, capped like the request metrics.
+
+        Called for requests rejected before they reach `record`, so the call
+        counts as one of the user's requests in TopUsers as well.
+        """
+        label = self.users.observe(user)
+        labels["user"] = label
+        values = tuple(labels[name] for name in metric._labelnames)
+        self._inc_user(metric, values, user, label, amount)
+
+    def record(self, backend, user, model, status, latency, tokens_in=0, tokens_out=0):
+        label = self.users.observe(user)
+        self._inc_user(self.request_count, (backend, label, status, model), user, label, 1)
+        self._child(self.request_latency, (backend, model)).observe(latency)
+
+        if tokens_in > 0:
+            self._inc_user(self.input_tokens, (backend, label, model), user, label, tokens_in)
+        if tokens_out > 0:
+            self._inc_user(self.output_tokens, (backend, label, model), user, label, tokens_out)
+
+        total_tokens = tokens_in + tokens_out
+        if latency > 0 and total_tokens > 0:
+            self._child(self.tokens_per_second, (backend, model)).set(total_tokens / latency)
@@ -0,0 +1,287 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from app.state import StateStore, StateStoreError, state_store
+
+
+COST_LEDGER_SHARDS = int(os.getenv("COST_LEDGER_SHARDS", "16"))
+# settled spending of the current UTC day is written here; off unless set.
+# One file per process: with several workers each would overwrite the others
+COST_CHECKPOINT_PATH = os.getenv("COST_CHECKPOINT_PATH", "")
+COST_CHECKPOINT_SECONDS = float(os.getenv("COST_CHECKPOINT_SECONDS", "30"))
+
+DAY_SECONDS = 86400
+
+logger = logging.getLogger(__name__)
+
+
+def day_index(now: Optional[float] = None) -> int:
+    # budgets run per UTC calendar day
+    return int((time.time() if now is None else now) // DAY_SECONDS)
+
+
+class Reservation:
+    """Estimated cost held against a user's budget until the request settles.
+
+    Settled or released at most once; both are no-ops afterwards, so error
+    paths can release unconditionally.
+    """
+
+    __slots__ = ("user", "day", "amount", "done")
+
+    def __init__(self, user: str, day: int, amount: float):
+        self.user = user
+        self.day = day
+        self.amount = amount
+        self.done = False
+
+
+class CostLedger(ABC):
+    """Per-user daily spending with reserve / settle / release.
+
+    `reserve` checks the budget and holds the estimate in one atomic step,
+    so concurrent requests cannot all pass the check and overspend.
+    `settle` swaps the estimate for the actual cost, `release` drops it.
+    Spending is charged to the day the reservation was made.
+    """
+
+    # calls do network round trips: keep them off the event loop
+    blocking = False
+
+    @abstractmethod
+    def reserve(self, user: str, amount: float, limit: float) -> Tuple[Optional[Reservation], float]:
+        """(reservation, spending including amount); no reservation when over the limit."""
+
+    @abstractmethod
+    def settle(self, reservation: Reservation, actual: float):
+        ...
+
+    @abstractmethod
+    def release(self, reservation: Reservation):
+        ...
+
+    @abstractmethod
+    def spent(self, user: str) -> float:
+        """Today's spending, reservations in flight included."""
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class _Shard:
+    __slots__ = ("lock", "entries")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # user -> [day, settled, reserved]
+        self.entries: Dict[str, List] = {}
+
+
+class ShardedCostLedger(CostLedger):
+    """In-process ledger: users hashed over shards, one lock per shard.
+
+    Requests of different users rarely share a lock, so threads (token
+    counting, the checkpoint writer) don't serialize on one global lock.
+    Each entry carries its day index; the first access on a new day resets
+    that one entry in place, so there is no global reset sweep. Settled
+    spending of the current day can be checkpointed to a JSON file
+    (COST_CHECKPOINT_PATH) and loaded back at start, so a restart keeps
+    today's budgets.
+
+    Per process: with several workers use a shared state store instead
+    (STATE_BACKEND=mmap|redis), which selects StoreCostLedger. Workers
+    sharing one checkpoint file would each write their own partial
+    snapshot over it.
+    """
+
+    def __init__(self, shards: int = COST_LEDGER_SHARDS, checkpoint_path: str = COST_CHECKPOINT_PATH,
+                 checkpoint_seconds: float = COST_CHECKPOINT_SECONDS):
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_seconds = checkpoint_seconds
+        self._task: Optional[asyncio.Task] = None
+        self.load()
+
+    def _shard(self, user: str) -> _Shard:
+        # crc32, not hash(): stable across processes and restarts
+        return self._shards[zlib.crc32(user.encode()) % len(self._shards)]
+
+    @staticmethod
+    def _entry(shard: _Shard, user: str, day: int) -> List:
+        entry = shard.entries.get(user)
+        if entry is None or entry[0] != day:
+            entry = shard.entries[user] = [day, 0.0, 0.0]
+        return entry
+
+    def reserve(self, user: str, amount: float, limit: float) -> Tuple[Optional[Reservation], float]:
+        day = day_index()
+        shard = self._shard(user)
+        with shard.lock:
+            entry = self._entry(shard, user, day)
+            total = entry[1] + entry[2] + amount
+            if total > limit:
+                return None, total
+            entry[2] += amount
+        return Reservation(user, day, amount), total
+
+    def settle(self, reservation: Reservation, actual: float):
+        if reservation.done:
+            return
+        reservation.done = True
+        shard = self._shard(reservation.user)
+        with shard.lock:
+            entry = shard.entries.get(reservation.user)
+            # a bucket already rolled over to a new day has nothing left to settle
+            if entry is not None and entry[0] == reservation.day:
+                entry[2] = max(0.0, entry[2] - reservation.amount)
+                entry[1] += actual
+
+    def release(self, reservation: Reservation):
+        if reservation.done:
+            return
+        reservation.done = True
+        shard = self._shard(reservation.user)
+        with shard.lock:
+            entry = shard.entries.get(reservation.user)
+            if entry is not None and entry[0] == reservation.day:
+                entry[2] = max(0.0, entry[2] - reservation.amount)
+
+    def spent(self, user: str) -> float:
+        day = day_index()
+        shard = self._shard(user)
+        with shard.lock:
+            entry = shard.entries.get(user)
+            if entry is None or entry[0] != day:
+                return 0.0
+            return entry[1] + entry[2]
+
+    def snapshot(self) -> Dict:
+        """Settled spending of today; drops entries left over from earlier days."""
+        day = day_index()
+        spent = {}
+        for shard in self._shards:
+            with shard.lock:
+                stale = [user for user, entry in shard.entries.items() if entry[0] != day]
+                for user in stale:
+                    del shard.entries[user]
+                spent.update((user, entry[1]) for user, entry in shard.entries.items() if entry[1])
+        return {"day": day, "spent": spent}
+
+    def checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        body = json.dumps(self.snapshot())
+        # write-then-rename: a crash mid-write leaves the previous checkpoint
+        tmp = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(body)
+        os.replace(tmp, self.checkpoint_path)
+
+    def load(self):
+        if not self.checkpoint_path:
+            return
+        try:
+            with open(self.checkpoint_path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as ex:
+            logger.warning("Cost checkpoint unreadable", extra={"fields": {"path": self.checkpoint_path, "error": str(ex)}})
+            return
+        day = data.get("day")
+        # yesterday's checkpoint means a fresh budget
+        if day != day_index():
+            return
+        for user, amount in data.get("spent", {}).items():
+            shard = self._shard(user)
+            with shard.lock:
+                self._entry(shard, user, day)[1] = float(amount)
+
+    async def _checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_seconds)
+            try:
+                await asyncio.to_thread(self.checkpoint)
+            except OSError as ex:
+                logger.warning("Cost checkpoint failed", extra={"fields": {"path": self.checkpoint_path, "error": str(ex)}})
+
+    def start(self):
+        if self.checkpoint_path and self._task is None:
+            self._task = asyncio.ensure_future(self._checkpoint_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            self.checkpoint()
+        except OSError as ex:
+            logger.warning("Cost checkpoint failed", extra={"fields": {"path": self.checkpoint_path, "error": str(ex)}})
+
+
+class StoreCostLedger(CostLedger):
+    """Ledger kept in a shared StateStore, one counter per user per UTC day.
+
+    The reservation is an atomic incr that is given back when it lands over
+    the limit, the same pattern as the shared rate limiter. The store
+    expires old days and outlives the workers, so there is nothing to
+    reset or checkpoint here.
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self.blocking = store.blocking
+
+    @staticmethod
+    def _key(user: str, day: int) -> str:
+        return f"cost:{user}:{day}"
+
+    def reserve(self, user: str, amount: float, limit: float) -> Tuple[Optional[Reservation], float]:
+        day = day_index()
+        key = self._key(user, day)
+        total = self.store.incr(key, amount, DAY_SECONDS)
+        if total > limit:
+            self.store.incr(key, -amount, DAY_SECONDS)
+            return None, total
+        return Reservation(user, day, amount), total
+
+    def settle(self, reservation: Reservation, actual: float):
+        if reservation.done:
+            return
+        reservation.done = True
+        self._adjust(reservation, actual - reservation.amount)
+
+    def release(self, reservation: Reservation):
+        if reservation.done:
+            return
+        reservation.done = True
+        self._adjust(reservation, -reservation.amount)
+
+    def _adjust(self, reservation: Reservation, delta: float):
+        if not delta:
+            return
+        try:
+            self.store.incr(self._key(reservation.user, reservation.day), delta, DAY_SECONDS)
+        except StateStoreError as ex:
+            # the response is already decided; the budget is off by delta until the day rolls over
+            logger.warning("Cost settle failed", extra={"fields": {"user": reservation.user, "delta": delta, "error": str(ex)}})
+
+    def spent(self, user: str) -> float:
+        return self.store.get(self._key(user, day_index()))
+
+
+def create_cost_ledger(store: StateStore = state_store) -> CostLedger:
+    # workers sharing a store have to share budgets too
+    if store.shared:
+        return StoreCostLedger(store)
+    return ShardedCostLedger()
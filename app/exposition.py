@@ -0,0 +1,163 @@
+"""/metrics exposition, single or multi worker.
+
+With PROMETHEUS_MULTIPROC_DIR set (before the service starts, empty, and
+shared by every worker) prometheus_client keeps metric values in per-pid
+mmap files in that directory. A scrape then reads and merges all of them,
+so any worker answers for the whole deployment. Empty the directory on
+every deploy: counter files of exited workers are kept on purpose so
+totals don't go backwards while the deployment runs.
+
+Series can't be removed from the files, so users a worker evicted from
+its top-K stay there. The merged output is capped instead: per family,
+the METRICS_TOP_USERS users with the highest merged totals keep their
+`user` label and everyone else is summed into "other". That only depends
+on the files, so every worker renders the same series.
+"""
+import glob
+import os
+import threading
+import time
+from typing import List, Optional
+
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
+from prometheus_client.multiprocess import MultiProcessCollector, mark_process_dead
+
+from app.cardinality import METRICS_TOP_USERS, OTHER_USER
+from app.metrics import ACTIVE_REQUESTS, BACKEND_PROBE_AGE, MODEL_INFO
+
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+# scrapes within this window reuse the last rendered body
+METRICS_CACHE_SECONDS = float(os.getenv("METRICS_CACHE_SECONDS", "1"))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def cap_users(family, k: int):
+    """Keeps the k users with the highest total in family by name, the rest
+    summed into OTHER_USER (only counters carry a user label)."""
+    totals = {}
+    for sample in family.samples:
+        user = sample.labels.get("user")
+        if user is not None and user != OTHER_USER:
+            totals[user] = totals.get(user, 0.0) + sample.value
+    if len(totals) <= k:
+        return family
+    keep = set(sorted(totals, key=lambda u: (-totals[u], u))[:k])
+    samples, other = [], {}
+    for sample in family.samples:
+        if "user" not in sample.labels or sample.labels["user"] in keep:
+            samples.append(sample)
+            continue
+        labels = dict(sample.labels, user=OTHER_USER)
+        key = (sample.name, tuple(sorted(labels.items())))
+        if key in other:
+            other[key] = other[key]._replace(value=other[key].value + sample.value)
+        else:
+            other[key] = sample._replace(labels=labels)
+    family.samples = samples + list(other.values())
+    return family
+
+
+class _MergedCollector:
+    """Metrics of every worker from the mmap files, plus the few that only
+    exist in this process (set_function gauges, Info)."""
+
+    def __init__(self, path: str, local_metrics, top_users: int = METRICS_TOP_USERS):
+        self.files = MultiProcessCollector(None, path)
+        self.local_metrics = local_metrics
+        self.top_users = top_users
+
+    def collect(self):
+        local = [family for metric in self.local_metrics for family in metric.collect()]
+        local_names = {family.name for family in local}
+        for family in self.files.collect():
+            if family.name not in local_names:
+                yield cap_users(family, self.top_users)
+        yield from local
+
+
+class MetricsExporter:
+
+    def __init__(self, path: str = PROMETHEUS_MULTIPROC_DIR, cache_seconds: float = METRICS_CACHE_SECONDS,
+                 local_metrics=(BACKEND_PROBE_AGE, MODEL_INFO)):
+        self.path = path
+        self.cache_seconds = cache_seconds
+        if path:
+            self.registry = CollectorRegistry()
+            self.registry.register(_MergedCollector(path, local_metrics))
+        else:
+            self.registry = REGISTRY
+
+        self._body: Optional[bytes] = None
+        self._rendered_at = 0.0
+        self._lock = threading.Lock()
+        self._active: Optional[float] = None
+        self._active_at = 0.0
+        self._active_lock = threading.Lock()
+
+    @property
+    def multiprocess(self) -> bool:
+        return bool(self.path)
+
+    def reap_dead_workers(self) -> List[int]:
+        """Drops the live-gauge files of workers that are gone (crashed or
+        restarted), so their in-flight counts stop adding up."""
+        pids = set()
+        for f in glob.glob(os.path.join(self.path, "gauge_live*_*.db")):
+            try:
+                pids.add(int(os.path.basename(f)[:-3].rsplit("_", 1)[1]))
+            except ValueError:
+                continue
+        dead = [pid for pid in pids if not _pid_alive(pid)]
+        for pid in dead:
+            mark_process_dead(pid, self.path)
+        return dead
+
+    def render(self) -> bytes:
+        # blocking (reads every worker's files), call it off the event loop
+        with self._lock:
+            now = time.monotonic()
+            if self._body is not None and now - self._rendered_at < self.cache_seconds:
+                return self._body
+            if self.multiprocess:
+                self.reap_dead_workers()
+            self._body = generate_latest(self.registry)
+            self._rendered_at = time.monotonic()
+            return self._body
+
+    def active_requests(self) -> float:
+        if not self.multiprocess:
+            return sum(sample.value for family in ACTIVE_REQUESTS.collect() for sample in family.samples)
+        # /health calls this: file reads at most once per cache window, and
+        # not behind a full render holding the render lock
+        with self._active_lock:
+            now = time.monotonic()
+            if self._active is None or now - self._active_at >= self.cache_seconds:
+                self._active = self._read_active()
+                self._active_at = now
+            return self._active
+
+    def _read_active(self) -> float:
+        # only the livesum files, not a full merge
+        self.reap_dead_workers()
+        files = glob.glob(os.path.join(self.path, "gauge_livesum_*.db"))
+        for family in MultiProcessCollector.merge(files):
+            if family.name == "llm_active_requests":
+                return sum(sample.value for sample in family.samples)
+        return 0.0
+
+    def worker_exit(self):
+        if self.multiprocess:
+            mark_process_dead(os.getpid(), self.path)
+
+
+metrics_exporter = MetricsExporter()
@@ -1,10 +1,12 @@
+import logging
+import os
 import time
-from typing import Dict
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List
 from fastapi import HTTPException
-from app.metrics import RATE_LIMIT_EXCEEDED
-
-
-user_requests: Dict[str, list] = {}
+from app.metrics import RATE_LIMIT_EXCEEDED, count_user
+from app.state import STATE_FAIL_MODE, StateStore, StateStoreError, run_store_call, state_store
 
 
 RATE_LIMTITS = {
@@ -14,35 +16,205 @@ RATE_LIMTITS = {
     "default" : 5
 }
 
+RATE_LIMIT_WINDOW_SECONDS = 60
+RATE_LIMIT_ENGINE = os.getenv("RATE_LIMIT_ENGINE", "sliding_window")
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "100000"))
+
+logger = logging.getLogger(__name__)
+
 def get_user_limit(user: str) -> int:
     return RATE_LIMTITS.get(user, RATE_LIMTITS["default"])
 
 
+class RateLimiter(ABC):
+    """Base for per-user limiters: O(1) per check, bounded memory.
+
+    State lives in an OrderedDict ordered by last access, so idle users sit
+    at the front and are evicted there, and the dict never holds more than
+    max_users keys.
+    """
+
+    def __init__(self, window: float = RATE_LIMIT_WINDOW_SECONDS, max_users: int = RATE_LIMIT_MAX_USERS):
+        self.window = window
+        self.max_users = max_users
+        self.state: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    @abstractmethod
+    def allow(self, user: str, limit: int, now: float) -> bool:
+        ...
+
+    @abstractmethod
+    def current(self, user: str, now: float) -> int:
+        ...
+
+    def _touch(self, user: str, now: float, fresh: List[float]) -> List[float]:
+        # evict first: popping the caller's entry after handing it out would
+        # orphan the update and the request would never be counted
+        self._evict(now, room=0 if user in self.state else 1)
+        entry = self.state.get(user)
+        if entry is None:
+            entry = fresh
+            self.state[user] = entry
+        else:
+            self.state.move_to_end(user)
+        return entry
+
+    def _evict(self, now: float, room: int = 0):
+        # entries last touched a full idle period ago carry no state worth keeping
+        while self.state:
+            user, entry = next(iter(self.state.items()))
+            if len(self.state) + room <= self.max_users and now - entry[-1] < self.idle_after():
+                break
+            self.state.popitem(last=False)
+
+    def idle_after(self) -> float:
+        return 2 * self.window
+
+
+class TokenBucketLimiter(RateLimiter):
+    # entry: [tokens, last_seen]; refills `limit` tokens per window
+
+    def allow(self, user: str, limit: int, now: float) -> bool:
+        entry = self._touch(user, now, [float(limit), now])
+        tokens = min(float(limit), entry[0] + (now - entry[1]) * limit / self.window)
+        entry[1] = now
+        if tokens < 1.0:
+            entry[0] = tokens
+            return False
+        entry[0] = tokens - 1.0
+        return True
+
+    def current(self, user: str, now: float) -> int:
+        limit = get_user_limit(user)
+        entry = self.state.get(user)
+        if entry is None:
+            return 0
+        tokens = min(float(limit), entry[0] + (now - entry[1]) * limit / self.window)
+        return int(limit - tokens)
+
+    def idle_after(self) -> float:
+        # an empty bucket is full again after one window
+        return self.window
+
+
+class SlidingWindowCounterLimiter(RateLimiter):
+    # entry: [window_start, previous_count, current_count, last_seen]
+    # estimate = previous * (unelapsed share of window) + current
+
+    def _roll(self, entry: List[float], now: float):
+        elapsed_windows = int((now - entry[0]) // self.window)
+        if elapsed_windows >= 1:
+            entry[1] = entry[2] if elapsed_windows == 1 else 0.0
+            entry[2] = 0.0
+            entry[0] += elapsed_windows * self.window
+
+    def _estimate(self, entry: List[float], now: float) -> float:
+        weight = 1.0 - (now - entry[0]) / self.window
+        return entry[1] * weight + entry[2]
+
+    def allow(self, user: str, limit: int, now: float) -> bool:
+        entry = self._touch(user, now, [now, 0.0, 0.0, now])
+        self._roll(entry, now)
+        entry[3] = now
+        if self._estimate(entry, now) >= limit:
+            return False
+        entry[2] += 1
+        return True
+
+    def current(self, user: str, now: float) -> int:
+        entry = self.state.get(user)
+        if entry is None:
+            return 0
+        self._roll(entry, now)
+        return int(round(self._estimate(entry, now)))
+
+
+class SharedSlidingWindowLimiter(RateLimiter):
+    """Sliding-window counter kept in a StateStore so every worker sees the same count.
+
+    Windows are aligned to the epoch so workers agree on the key without
+    talking to each other. Counters expire in the store, so there is no
+    local state to evict.
+    """
+
+    def __init__(self, store: StateStore, window: float = RATE_LIMIT_WINDOW_SECONDS):
+        super().__init__(window=window)
+        self.store = store
+
+    def _keys(self, user: str, now: float):
+        index = int(now // self.window)
+        weight = 1.0 - (now - index * self.window) / self.window
+        return f"rl:{user}:{index - 1}", f"rl:{user}:{index}", weight
+
+    def allow(self, user: str, limit: int, now: float) -> bool:
+        previous_key, current_key, weight = self._keys(user, now)
+        # one round trip; a rejected request pays a second to give the slot back
+        current, (previous,) = self.store.incr_and_get(current_key, 1, 2 * self.window, [previous_key])
+        if previous * weight + current > limit:
+            # give the slot back, the request is rejected
+            self.store.incr(current_key, -1, 2 * self.window)
+            return False
+        return True
+
+    def current(self, user: str, now: float) -> int:
+        previous_key, current_key, weight = self._keys(user, now)
+        previous, current = self.store.get_many([previous_key, current_key])
+        return int(round(previous * weight + current))
+
+
+RATE_LIMIT_ENGINES = {
+    "sliding_window": SlidingWindowCounterLimiter,
+    "token_bucket": TokenBucketLimiter,
+}
+
+# workers sharing a store have to share the counters too
+if state_store.shared:
+    rate_limiter: RateLimiter = SharedSlidingWindowLimiter(state_store)
+else:
+    rate_limiter = RATE_LIMIT_ENGINES[RATE_LIMIT_ENGINE]()
+
+
+def state_store_unavailable(ex: StateStoreError, what: str):
+    """Store down: let the request through (STATE_FAIL_MODE=open) or reject it with a 503."""
+    if STATE_FAIL_MODE == "open":
+        logger.warning("State store unavailable, not enforcing", extra={"fields": {"check": what, "error": str(ex)}})
+        return
+    raise HTTPException(
+        status_code=503,
+        detail=f"{what} unavailable: {ex}"
+    )
+
+
 def check_rate_limit(user: str) -> bool:
-    current_time = time.time()
+    """Synchronous check for callers off the event loop; the store call blocks.
+
+    Store down: True with STATE_FAIL_MODE=open, StateStoreError otherwise.
+    """
     limit = get_user_limit(user)
+    try:
+        allowed = rate_limiter.allow(user, limit, time.time())
+    except StateStoreError as ex:
+        if STATE_FAIL_MODE != "open":
+            raise
+        logger.warning("State store unavailable, not enforcing", extra={"fields": {"check": "rate limiter", "error": str(ex)}})
+        return True
+    if not allowed:
+        count_user(RATE_LIMIT_EXCEEDED, user)
+    return allowed
 
-    if user not in user_requests:
-        user_requests[user] = []
-
-    cutoff_time = current_time - 60
-    user_requests[user] = [
-        req_time for req_time in user_requests[user]
-        if req_time > cutoff_time
-    ]
-
-    if len(user_requests[user]) >= limit:
-        RATE_LIMIT_EXCEEDED.labels(user=user).inc()
-        return False
-    
-    user_requests[user].append(current_time)
-    return True
-
-def enforce_rate_limit(user: str):
-    if not check_rate_limit(user):
-        current_requests = len(user_requests.get(user, []))
-        limit = get_user_limit(user)
-        raise HTTPException(
-            status_code=429,
-            detail=f"Rate limit exceeded : {current_requests}/{limit} requests per minute"
-        )
\ No newline at end of file
+
+async def enforce_rate_limit(user: str):
+    limit = get_user_limit(user)
+    try:
+        if await run_store_call(state_store, rate_limiter.allow, user, limit, time.time()):
+            return
+        current_requests = await run_store_call(state_store, rate_limiter.current, user, time.time())
+    except StateStoreError as ex:
+        state_store_unavailable(ex, "rate limiter")
+        return
+
+    count_user(RATE_LIMIT_EXCEEDED, user)
+    raise HTTPException(
+        status_code=429,
+        detail=f"Rate limit exceeded : {current_requests}/{limit} requests per minute"
+    )
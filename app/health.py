@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from app.backend import BackendClient
+from app.metrics import BACKEND_PROBE_AGE, BACKEND_PROBE_ERROR_RATE, BACKEND_PROBE_LATENCY, BACKEND_UP
+
+
+logger = logging.getLogger(__name__)
+
+HEALTH_POLL_INTERVAL = float(os.getenv("HEALTH_POLL_INTERVAL", "5"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "2"))
+HEALTH_WINDOW = int(os.getenv("HEALTH_WINDOW", "20"))
+
+
+class BackendHealthPoller:
+    """Probes the backend in the background so /health never waits on it.
+
+    Keeps the last `window` probe results for a rolling latency and error
+    rate; /health just reads snapshot().
+    """
+
+    def __init__(
+        self,
+        client: BackendClient,
+        backend_id: str,
+        interval: float = HEALTH_POLL_INTERVAL,
+        timeout: float = HEALTH_PROBE_TIMEOUT,
+        window: int = HEALTH_WINDOW,
+    ):
+        self.client = client
+        self.backend_id = backend_id
+        self.interval = interval
+        self.timeout = timeout
+
+        self.healthy = False
+        self.last_probe_at: Optional[float] = None
+        self.last_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._latencies = deque(maxlen=window)
+        self._errors = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+        BACKEND_PROBE_AGE.labels(backend=backend_id).set_function(self.probe_age)
+
+    def probe_age(self) -> float:
+        if self.last_probe_at is None:
+            return float("inf")
+        return time.monotonic() - self.last_probe_at
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self._errors) / len(self._errors) if self._errors else 0.0
+
+    @property
+    def avg_latency(self) -> Optional[float]:
+        return sum(self._latencies) / len(self._latencies) if self._latencies else None
+
+    async def probe_once(self) -> bool:
+        started = time.monotonic()
+        try:
+            response = await self.client.version(timeout=self.timeout)
+            healthy = response.status_code == 200
+            self.last_error = None if healthy else f"HTTP {response.status_code}"
+        except Exception as e:
+            healthy = False
+            self.last_error = str(e) or type(e).__name__
+
+        latency = time.monotonic() - started
+        self.healthy = healthy
+        self.last_probe_at = time.monotonic()
+        self.last_latency = latency
+        self._latencies.append(latency)
+        self._errors.append(0 if healthy else 1)
+
+        BACKEND_UP.labels(backend=self.backend_id).set(1 if healthy else 0)
+        BACKEND_PROBE_LATENCY.labels(backend=self.backend_id).set(latency)
+        BACKEND_PROBE_ERROR_RATE.labels(backend=self.backend_id).set(self.error_rate)
+        return healthy
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.probe_once()
+            except Exception as e:
+                logger.exception("Health probe crashed", extra={"fields": {"backend": self.backend_id, "error": repr(e)}})
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict:
+        avg = self.avg_latency
+        return {
+            "backend": self.backend_id,
+            "healthy": self.healthy,
+            "last_probe_age_seconds": round(self.probe_age(), 3) if self.last_probe_at is not None else None,
+            "last_latency_seconds": round(self.last_latency, 4) if self.last_latency is not None else None,
+            "avg_latency_seconds": round(avg, 4) if avg is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "last_error": self.last_error
+        }
@@ -29,7 +29,7 @@ class LLMOpsUser(HttpUser):
             if response.status_code == 200:
                 try:
                     result = response.json()
-                    if "text" in result and result["text"]:
+                    if result.get("generated_text"):
                         response.success()
                     else:
                         response.failure("Empty or invalid response")
@@ -56,7 +56,7 @@ class LLMOpsUser(HttpUser):
             if response.status_code == 200:
                 try:
                     result = response.json()
-                    if "text" in result and result["text"]:
+                    if result.get("generated_text"):
                         response.success()
                     else:
                         response.failure("Empty or invalid response")
@@ -81,8 +81,9 @@ def track_tokens(name, response, **kwargs):
     if response and hasattr(response, 'json'):
         try:
              data = response.json()
-             if 'tokens_used' in data and data['tokens_used'] > 0 :
-                 print(f"token: {data['tokens_used']}")
+             total_tokens = data.get('metrics', {}).get('total_tokens', 0)
+             if total_tokens > 0 :
+                 print(f"token: {total_tokens}")
         except:
             pass
 
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from app.metrics import LOG_RECORDS_DROPPED
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json | text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# longer string fields (and messages) are cut to this many chars
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "512"))
+# "DEBUG=0.01,INFO=0.1": share of records kept per level, unlisted levels keep all
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+# httpx logs every request at INFO
+LOG_HTTPX_LEVEL = os.getenv("LOG_HTTPX_LEVEL", "WARNING").upper()
+
+request_logger = logging.getLogger("app.requests")
+
+_DROPPED_SAMPLED = LOG_RECORDS_DROPPED.labels(reason="sampled")
+_DROPPED_QUEUE_FULL = LOG_RECORDS_DROPPED.labels(reason="queue_full")
+
+
+def parse_sample_rates(spec: str) -> Dict[int, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        level, rate = item.split("=", 1)
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+def _truncate(value: str, limit: int) -> str:
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}...(+{len(value) - limit} chars)"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; structured fields come from extra={"fields": {...}}."""
+
+    def __init__(self, max_field_chars: int = LOG_MAX_FIELD_CHARS):
+        super().__init__()
+        self.max_field_chars = max_field_chars
+
+    def _field(self, value):
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        if not isinstance(value, str):
+            encoded = json.dumps(value, default=str)
+            # small structures stay nested, big ones become a cut-off string
+            return value if len(encoded) <= self.max_field_chars else _truncate(encoded, self.max_field_chars)
+        return _truncate(value, self.max_field_chars)
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": _truncate(record.getMessage(), self.max_field_chars)
+        }
+        for key, value in getattr(record, "fields", {}).items():
+            out[key] = self._field(value)
+        if getattr(record, "sample_rate", 1.0) < 1.0:
+            out["sample_rate"] = record.sample_rate
+        if record.exc_info:
+            out["exc"] = _truncate(self.formatException(record.exc_info), self.max_field_chars * 4)
+        return json.dumps(out, default=str)
+
+
+class TextFormatter(logging.Formatter):
+
+    def __init__(self, max_field_chars: int = LOG_MAX_FIELD_CHARS):
+        super().__init__("%(levelname)s:%(name)s:%(message)s")
+        self.max_field_chars = max_field_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = _truncate(super().format(record), self.max_field_chars * 4)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={_truncate(str(v), self.max_field_chars)}" for k, v in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0:
+            return True
+        if random.random() < rate:
+            record.sample_rate = rate
+            return True
+        _DROPPED_SAMPLED.inc()
+        return False
+
+
+class AsyncQueueHandler(QueueHandler):
+    """Hands records to the listener thread as they are.
+
+    The stock QueueHandler formats the message in the calling thread; here
+    formatting and the write both happen on the listener thread, so the
+    event loop only pays for building the LogRecord. A full queue drops the
+    record instead of blocking.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DROPPED_QUEUE_FULL.inc()
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, sample_rates: str = LOG_SAMPLE_RATES):
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    handler = AsyncQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(SamplingFilter(parse_sample_rates(sample_rates)))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    logging.getLogger("httpx").setLevel(LOG_HTTPX_LEVEL)
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    # drains the queue before returning
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_request(level: int = logging.INFO, exc_info: bool = False, **fields):
+    """The single per-request record: user, status, latency, tokens, cost, ..."""
+    if request_logger.isEnabledFor(level):
+        request_logger.log(level, "request", exc_info=exc_info, extra={"fields": fields})
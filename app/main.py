@@ -1,25 +1,41 @@
+import time
+_module_started = time.perf_counter()
+
+import asyncio
+from contextlib import aclosing
 import json
 import logging
 import re
-from typing import Dict
+from typing import AsyncIterator, Dict, Optional, Tuple
 from fastapi import FastAPI, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import PlainTextResponse
-from prometheus_client import generate_latest
-import requests
-import time
-import tiktoken
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import httpx
 import os
 import jwt
 
-from app.governance import enforce_rate_limit
+from app.cache import RESPONSE_CACHE_BYPASS_RATE_LIMIT, RESPONSE_CACHE_CHARGE_COST, response_cache
+from app.cost import CostLedger, Reservation, create_cost_ledger
+from app.exposition import metrics_exporter
+from app.governance import enforce_rate_limit, state_store_unavailable
+from app.logs import log_request, setup_logging, stop_logging
+from app.router import OLLAMA_BACKENDS, BackendRouter, NoBackendAvailable, parse_backends
+from app.safety import SafetyScanner
+from app.scheduler import QueueFullError, Scheduler
+from app.schemas import FastJSONResponse, GenerateRequest, GenerateResponse, dumps
+from app.singleflight import singleflight
+from app.spans import StageTimingMiddleware, mark_stage
+from app.state import StateStoreError, run_store_call
+from app.tokens import TokenCounter
 from app.metrics import (
-    CONTENT_FILTER, COST_BLOCKED_REQUEST, GUARDRAIL_VIOLATION, SAFETY_VIOLATION, record_requst, ACTIVE_REQUESTS, MODEL_INFO, TOKENS_PER_SECOND
+    CONTENT_FILTER, COST_BLOCKED_REQUEST, GUARDRAIL_VIOLATION, SAFETY_VIOLATION, record_requst, ACTIVE_REQUESTS, MODEL_INFO, TOKENS_PER_SECOND,
+    count_user, metrics_recorder,
+    TIME_TO_FIRST_TOKEN, SERVICE_READY, STARTUP_PHASE_SECONDS
 )
 
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: JSON lines written by a background thread, see app/logs.py
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -27,12 +43,16 @@ app = FastAPI(
     title="LLMOps LLM service",
     version="2.0.0"
 )
+# per-stage latency histogram (and optional Server-Timing header) for /generate
+app.add_middleware(StageTimingMiddleware)
 
-OLLAMA_HOST = "localhost"
-OLLAMA_PORT = "11434"
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "localhost")
+OLLAMA_PORT = os.getenv("OLLAMA_PORT", "11434")
 
-OLLAMA_URL = f"http://{OLLAMA_HOST}:{OLLAMA_PORT}/api/generate"
-MODEL_NAME = "tinyllama"
+# default single backend; set OLLAMA_BACKENDS to route across several hosts
+OLLAMA_BASE_URL = f"http://{OLLAMA_HOST}:{OLLAMA_PORT}"
+OLLAMA_URL = f"{OLLAMA_BASE_URL}/api/generate"
+MODEL_NAME = os.getenv("MODEL_NAME", "tinyllama")
 BACKEND = "ollama"
 
 
@@ -40,12 +60,6 @@ JWT_SECRET = os.getenv("JWT_SECRET")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 JWT_EXPIRY_SECONDS = int(os.getenv("EXP", str(3600 * 4)))
 
-try:
-    tokenizer = tiktoken.get_encoding("cl100k_base")
-except Exception as e:
-    logger.warning(f"Could not load tokenizer: {e}")
-    tokenizer = None
-
 security = HTTPBearer()
 
 def create_jwt_for_user(username: str, role: str = "user") -> str:
@@ -103,34 +117,17 @@ class ContentFilter:
             'email': re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
         }
 
-    def check_content_safety(self, text: str) -> Dict:
-        violations = []
-        severity = "none"
-
-        text_lower = text.lower()
-
-
-            #checked banned keywords
-        for keyword in self.banned_keywords:
-            if keyword in text_lower:
-                violations.append(f"banned_keywords: {keyword}")
-                severity = "high"
+        self._scanner = None
 
-        for pattern in self.injection_patterns:
-            if pattern.search(text):
-                violations.append("prompt_injection_detected")
-        # check for pii
-        for pii_type, pattern in self.pii_patterns.items():
-            if pattern.search(text):
-                violations.append(f"pii_detected: {pii_type}")
-                if severity == "none":
-                    severity = "medium"
+    @property
+    def scanner(self) -> SafetyScanner:
+        # one compiled pass for keywords + injection + pii, built on first use
+        if self._scanner is None:
+            self._scanner = SafetyScanner(self.banned_keywords, self.injection_patterns, self.pii_patterns)
+        return self._scanner
 
-        return {
-            "safe": len(violations) == 0,
-            "violations": violations,
-            "severity": severity
-        }
+    def check_content_safety(self, text: str) -> Dict:
+        return self.scanner.scan(text)
 
 
     def sanitize_output(self, text: str) -> str:
@@ -140,21 +137,70 @@ class ContentFilter:
 
 content_filter = ContentFilter()
 
+FILTERED_OUTPUT = "[CONTENT FILTERED - SAFETY VIOLATION]"
+
+
+class StreamingOutputFilter:
+    """Runs the output safety check incrementally over a streamed response.
+
+    Text is only released up to the last whitespace, so an email split
+    across chunks is still sanitized, and each check covers the released
+    tail plus the pending text so keywords spanning chunks are caught.
+    """
+
+    def __init__(self, content_filter: ContentFilter, window: int = 256):
+        self.content_filter = content_filter
+        self.window = window
+        self.tail = ""
+        self.pending = ""
+        self.violation = None
+
+    def _check(self, text: str) -> bool:
+        result = self.content_filter.check_content_safety(self.tail + text)
+        if not result["safe"]:
+            self.violation = result
+            return False
+        return True
+
+    def _release(self, text: str) -> str:
+        self.tail = (self.tail + text)[-self.window:]
+        return self.content_filter.sanitize_output(text)
+
+    def feed(self, chunk: str) -> str:
+        self.pending += chunk
+        cut = max(self.pending.rfind(" "), self.pending.rfind("\n"))
+        if cut < 0:
+            return ""
+        ready, self.pending = self.pending[:cut + 1], self.pending[cut + 1:]
+        if not self._check(ready):
+            return ""
+        return self._release(ready)
+
+    def flush(self) -> str:
+        ready, self.pending = self.pending, ""
+        if not ready or not self._check(ready):
+            return ""
+        return self._release(ready)
+
 
 
 class Guardrails:
     def __init__(self):
         self.max_prompt_length = 400
         self.max_output_tokens = 300
+        # accepted requests are generated with at most this many tokens
+        self.max_generation_tokens = 200
 
 
-    def validate_Request(self, payload: Dict, user: str) -> Dict:
+    def validate_Request(self, request: GenerateRequest) -> Dict:
+        # types and defaults are already handled by GenerateRequest
         violations = []
-        prompt = payload.get("prompt", "")
-        max_tokens = payload.get("max_tokens", 50)
+        prompt = request.prompt
+        max_tokens = request.max_tokens
+        user = request.user
 
         if len(prompt) > self.max_prompt_length:
-            violations.append(f"prompt too longs : {len(prompt) > {self.max_prompt_length}}")
+            violations.append(f"prompt too longs : {len(prompt)} > {self.max_prompt_length}")
 
 
         if max_tokens > self.max_output_tokens:
@@ -168,6 +214,9 @@ class Guardrails:
             "violations": violations
         }
 
+    def generation_tokens(self, request: GenerateRequest) -> int:
+        return min(request.max_tokens, self.max_generation_tokens)
+
 
 guardrails = Guardrails()
 
@@ -175,8 +224,8 @@ COST_PER_INPUT_TOKEN = 0.001
 COST_PER_OUTPUT_TOKEN = 0.004
 
 class CostController:
-    
-    def __init__(self):
+
+    def __init__(self, ledger: CostLedger = None):
         self.daily_limits = {
             "alice" : 10.0,
             "bob" : 100.0,
@@ -184,56 +233,123 @@ class CostController:
             "default": 0.5
         }
 
-        self.daily_spending: Dict[str, float] = {}
-        self.last_rest = time.time()
+        # per-user, per-UTC-day spending, see app/cost.py
+        self.ledger = ledger or create_cost_ledger()
 
-    def reset_daily_if_needed(self):
-        current_time = time.time()
-        if current_time - self.last_rest > 86400:
-            self.daily_spending = {}
-            self.last_rest = current_time
+    def daily_limit(self, user: str) -> float:
+        return self.daily_limits.get(user, self.daily_limits["default"])
+
+    def get_spending(self, user: str) -> float:
+        return self.ledger.spent(user)
 
     def calculate_cost(self, input_tokens: int, output_token: int) -> float:
         input_cost = input_tokens * COST_PER_INPUT_TOKEN
         output_cost = output_token * COST_PER_OUTPUT_TOKEN
         return input_cost + output_cost
-    
-    
-    def check_cost_limit(self, user: str, estimated_cost: float) -> Dict:
-        self.reset_daily_if_needed()
 
-        current_spending = self.daily_spending.get(user, 0.0)
-        daily_limit = self.daily_limits.get(user, self.daily_limits["default"])
+    async def reserve_cost(self, user: str, estimated_cost: float) -> Dict:
+        """Check the budget and hold the estimate in one step."""
+        daily_limit = self.daily_limit(user)
+        try:
+            reservation, total = await run_store_call(self.ledger, self.ledger.reserve, user, estimated_cost, daily_limit)
+        except StateStoreError as ex:
+            state_store_unavailable(ex, "cost budget")
+            return {"allowed": True}
 
-        if current_spending + estimated_cost > daily_limit:
+        if reservation is None:
             return {
                 "allowed": False,
-                "reason": f"Daily limit exceeded ${current_spending + estimated_cost:.4f} > ${daily_limit}",
-                "current_pending": current_spending,
+                "reason": f"Daily limit exceeded ${total:.4f} > ${daily_limit}",
+                "current_pending": total - estimated_cost,
                 "daily_limit": daily_limit
             }
-        return{"allowed": True}
-    
-    def record_spending(self, user: str, cost: float):
-        self.reset_daily_if_needed()
-        self.daily_spending[user] = self.daily_spending.get(user, 0.0) + cost
+        return {"allowed": True, "reservation": reservation}
+
+    async def settle(self, reservation: Optional[Reservation], actual_cost: float):
+        if reservation is not None and not reservation.done:
+            await run_store_call(self.ledger, self.ledger.settle, reservation, actual_cost)
+
+    async def release(self, reservation: Optional[Reservation]):
+        if reservation is not None and not reservation.done:
+            await run_store_call(self.ledger, self.ledger.release, reservation)
 
 costcontroller = CostController()
 
+token_counter = TokenCounter()
+
+
 def _count_tokens(text: str) -> int:
-    if not text or not tokenizer:
-        return len(text.split())
-    return len(tokenizer.encode(text))
+    return token_counter.count(text)
+
+
+router = BackendRouter(parse_backends(OLLAMA_BACKENDS, OLLAMA_BASE_URL))
+
+
+warmup_state = {
+    "ready": False,
+    "phases": {},
+    "tokenizer": False,
+    "ollama_backend": False
+}
+warmup_task = None
+
+
+def _record_phase(phase: str, started: float):
+    elapsed = time.perf_counter() - started
+    warmup_state["phases"][phase] = round(elapsed, 4)
+    STARTUP_PHASE_SECONDS.labels(phase=phase).set(elapsed)
+
+
+async def _warm_up():
+    # heavy resources load here, after uvicorn is already accepting connections
+    started = time.perf_counter()
+    warmup_state["tokenizer"] = await asyncio.to_thread(token_counter.warm)
+    _record_phase("tokenizer", started)
+
+    started = time.perf_counter()
+    content_filter.scanner  # builds the compiled matchers
+    _record_phase("safety_scanner", started)
+
+    started = time.perf_counter()
+    warmup_state["ollama_backend"] = await router.probe_all()
+    if warmup_state["ollama_backend"]:
+        logger.info("Ollama heaklth check: ok")
+    else:
+        logger.error("Could not connect to Ollama", extra={"fields": {"backends": router.snapshot()}})
+    _record_phase("backend_probe", started)
+    router.start_polling()
+
+    warmup_state["ready"] = True
+    SERVICE_READY.set(1)
+    logger.info("Warm-up finished", extra={"fields": {"phases": warmup_state["phases"]}})
+
+
+_record_phase("module_import", _module_started)
 
 
 @app.on_event("startup")
 async def startup_event():
+    global warmup_task
+    started = time.perf_counter()
     logger.info("Starting LLMOps Ollama tiny llm service")
-    try:
-        response = requests.get("http://localhost:11434/api/version", timeout=5)
-        logger.info(f"Ollama heaklth check: {response.status_code}")
-    except Exception as e:
-        logger.error(f"Could not connect to Ollama: {e}")
+    await router.start()
+    scheduler.start()
+    metrics_recorder.start()
+    costcontroller.ledger.start()
+    warmup_task = asyncio.ensure_future(_warm_up())
+    _record_phase("startup_event", started)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    await scheduler.stop()
+    await router.close()
+    await metrics_recorder.stop()
+    await costcontroller.ledger.stop()
+    metrics_exporter.worker_exit()
+    stop_logging()
 
 
 @app.get("/")
@@ -244,147 +360,218 @@ def root():
 
 @app.get("/health")
 def health():
-    try:
-        response = requests.get("http://localhost:11434/api/version", timeout=5)
-        healthy = response.status_code == 200
-    except:
-        healthy = False
+    # cached result of the background pollers, no backend call here
+    healthy = router.healthy()
 
     status = "healthy" if healthy else "degraded"
 
     return {
         "status" : status,
         "ollama_backend": healthy,
+        "backends": router.snapshot(),
         "model": MODEL_NAME,
-        "active_requests" : int(ACTIVE_REQUESTS._value._value),
+        "active_requests" : int(metrics_exporter.active_requests()),
         "timestamp" : time.time()
     }
 
+@app.get("/ready")
+def ready():
+    # readiness is separate from /health: it only flips once warm-up is done
+    body = {
+        "ready": warmup_state["ready"],
+        "tokenizer": warmup_state["tokenizer"],
+        "ollama_backend": warmup_state["ollama_backend"],
+        "startup_phases": warmup_state["phases"]
+    }
+    if not warmup_state["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
 @app.get("/metrics")
-def get_metrics():
+async def get_metrics():
+    # flush on the loop, which owns the pending counts; render in a thread
+    metrics_recorder.flush()
     return PlainTextResponse(
-        generate_latest(),
+        await asyncio.to_thread(metrics_exporter.render),
         media_type="text/plain"
     )
 
-@app.post("/generate")
-async def generate_text(payload: dict):
-    user = payload.get("user", "anyonymous")
-    prompt = payload.get("prompt", "").strip()
-    max_tokens = min(payload.get("max_tokens", 50), 200)
-    temperature = max(0.0, min(2.0, payload.get("temperature", 0.7)))
+async def _generate_from_backend(user: str, prompt: str, max_tokens: int, temperature: float) -> Tuple[str, str]:
+    ollama_payload = {
+        "model": MODEL_NAME,
+        "prompt": prompt,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": False
+    }
+
+    #Robuse json parsing
+    try:
+        result, backend_id = await router.generate(ollama_payload)
+    except ValueError as ex:
+        logger.error("Value error occured", extra={"fields": {"user": user, "error": str(ex)}})
+        result, backend_id = {}, BACKEND
+
+    generated_text = None
+    if "response" in result and isinstance(result["response"], str):
+        generated_text = result["response"].strip()
+    elif "completions" in result and len(result["completions"]) > 0:
+        generated_text = result["completions"][0].get("text", "").strip()
+
+    if not generated_text:
+        raise HTTPException(
+            status_code=500,
+            detail="NO valid response"
+        )
+    return generated_text, backend_id
+
+
+async def _run_generation(job: Dict) -> Tuple[str, str]:
+    return await _generate_from_backend(**job)
+
+
+# bounded, per-user fair queue in front of the backend
+scheduler = Scheduler(runner=_run_generation)
+
+
+def _rejected(user: str, status: int, reason: str, stream: bool, received_at: float) -> HTTPException:
+    # rejections get the same per-request record as served requests
+    log_request(logging.WARNING, user=user, status=status, model=MODEL_NAME, stream=stream,
+                latency=round(time.time() - received_at, 4), error=reason)
+    return HTTPException(status_code=status, detail=reason)
+
+
+@app.post("/generate", response_model=GenerateResponse, response_class=FastJSONResponse)
+async def generate_text(payload: GenerateRequest):
+    received_at = time.time()
+    user = payload.user
+    prompt = payload.prompt
+    max_tokens = guardrails.generation_tokens(payload)
+    temperature = payload.temperature
+    mark_stage("parse")
 
 
     if not prompt:
-        raise HTTPException(status_code=400, detail="Prompt not available")
+        raise _rejected(user, 400, "Prompt not available", payload.stream, received_at)
     
     #Step 1: Content safety check
     safety_result = content_filter.check_content_safety(prompt)
+    mark_stage("safety")
     if not safety_result["safe"]:
         SAFETY_VIOLATION.labels(
             violation_type = "content_filter",
             severity = safety_result["severity"]
         ).inc()
 
-        CONTENT_FILTER.labels(user=user, filter_type="safety").inc()
+        count_user(CONTENT_FILTER, user, filter_type="safety")
 
-        raise HTTPException(
-            status_code=400,
-            detail= f"content safety violations: {', '.join(safety_result['violations'])}"
-        )
+        raise _rejected(user, 400, f"content safety violations: {', '.join(safety_result['violations'])}",
+                        payload.stream, received_at)
     
     # step 2: business guarrails:
-    guardrails_result = guardrails.validate_Request(payload=payload, user=user)
+    guardrails_result = guardrails.validate_Request(payload)
+    mark_stage("guardrails")
     if not guardrails_result["valid"]:
-        GUARDRAIL_VIOLATION.labels(user=user, violation_type = "business_rule").inc()
-        raise HTTPException(
-            status_code=400,
-            detail=f"Guardrail violations: {', '.join(guardrails_result['violations'])}"
-        )
+        count_user(GUARDRAIL_VIOLATION, user, violation_type="business_rule")
+        raise _rejected(user, 400, f"Guardrail violations: {', '.join(guardrails_result['violations'])}",
+                        payload.stream, received_at)
+    stream = payload.stream
+
+    # Response cache lookup, only for deterministic non-streaming settings
+    cache_key = None
+    cached_text = None
+    if not stream and response_cache.cacheable(temperature):
+        cache_key = response_cache.make_key(MODEL_NAME, prompt, max_tokens, temperature)
+        cached_text = response_cache.get(cache_key)
+    cache_hit = cached_text is not None
+    mark_stage("cache_lookup")
+
     # Enforce governance
-    enforce_rate_limit(user)
+    if not (cache_hit and RESPONSE_CACHE_BYPASS_RATE_LIMIT):
+        try:
+            await enforce_rate_limit(user)
+        except HTTPException as e:
+            # 429, or 503 with the state store down
+            raise _rejected(user, e.status_code, e.detail, stream, received_at)
+    mark_stage("rate_limit")
+
+    charge_cost = not cache_hit or RESPONSE_CACHE_CHARGE_COST
 
     input_tokens = _count_tokens(prompt)
+    mark_stage("token_count")
     estimated_output_tokens = min(max_tokens, 100)
     estimated_cost = costcontroller.calculate_cost(input_tokens, estimated_output_tokens)
 
-    cost_check = costcontroller.check_cost_limit(user, estimated_cost)
+    # held now, settled with the actual cost below, released if the request fails
+    try:
+        cost_check = await costcontroller.reserve_cost(user, estimated_cost) if charge_cost else {"allowed": True}
+    except HTTPException as e:
+        raise _rejected(user, e.status_code, e.detail, stream, received_at)
+    mark_stage("cost_check")
     if not cost_check["allowed"]:
-        COST_BLOCKED_REQUEST.labels(user=user).inc()
-        raise HTTPException(
-            status_code=429,
-            detail=f"Cost limit exceeded: {cost_check['reason']}"
+        count_user(COST_BLOCKED_REQUEST, user)
+        raise _rejected(user, 429, f"Cost limit exceeded: {cost_check['reason']}", stream, received_at)
+    reservation = cost_check.get("reservation")
+
+    if stream:
+        return StreamingResponse(
+            _stream_generation(user, prompt, max_tokens, temperature, reservation),
+            media_type="application/x-ndjson"
         )
 
     ACTIVE_REQUESTS.inc()
     start_time = time.time()
 
     try:
-        ollama_payload = {
-            "model": MODEL_NAME,
-            "prompt": prompt,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "stream": False
-        }
-
-        logger.info(f"Processing Request for User {user} --> Ollama : {OLLAMA_URL}")
-
-        response = requests.post(
-            OLLAMA_URL,
-            json=ollama_payload,
-            timeout=60,
-            headers={"Content-Type": "application/json"}
-        )
-
-        response.raise_for_status()
+        if cache_hit:
+            generated_text, backend_id, coalesced = cached_text, "cache", False
+        else:
+            submit = lambda: scheduler.submit(user, {
+                "user": user,
+                "prompt": prompt,
+                "max_tokens": max_tokens,
+                "temperature": temperature
+            })
+            # a sampled answer belongs to the caller that asked for it; only
+            # settings the cache treats as deterministic are shared
+            if temperature <= response_cache.max_temperature:
+                (generated_text, backend_id), coalesced = await singleflight.do(
+                    (MODEL_NAME, prompt, max_tokens, temperature), submit
+                )
+            else:
+                (generated_text, backend_id), coalesced = await submit(), False
+            if cache_key is not None and not coalesced:
+                response_cache.put(cache_key, generated_text)
+        mark_stage("backend")
 
-        #Robuse json parsing
-        text = response.text.strip()
-        try:
-            result = response.json()
-            logger.info(f"result: {result}")
-        except ValueError as ex:
-            logger.error(f"Value error occured : {str(ex)}")
-
-        generated_text = None
-        if "response" in result and isinstance(result["response"], str):
-            generated_text = result["response"].strip()
-        elif "completions" in result and len(result["completions"]) > 0:
-            generated_text = result["completions"][0].get("text", "").strip()
-
-
-        if not generated_text:
-            raise HTTPException(
-                status_code=500,
-                detail="NO valid response"
-            )
-        
         # step 5:  Output safety check
         output_safety = content_filter.check_content_safety(generated_text)
         if not output_safety["safe"]:
             SAFETY_VIOLATION.labels(
-                violiation_type = "output_filter",
+                violation_type = "output_filter",
                 severity=output_safety["severity"]
             ).inc()
-            generate_text = "[CONTENT FILTERED - SAFETY VIOLATION]"
+            output_text = FILTERED_OUTPUT
         else:
-            generate_text = content_filter.sanitize_output(generated_text)
+            output_text = content_filter.sanitize_output(generated_text)
+        mark_stage("output_filter")
         end_time = time.time()
         latency = end_time - start_time
 
-        # count tokens
+        # count tokens (prompt count is already cached from the estimate)
         input_tokens = _count_tokens(prompt)
-        output_tokens = _count_tokens(generated_text)
+        output_tokens = await token_counter.count_async(generated_text)
+        mark_stage("recount")
 
         actual_cost = costcontroller.calculate_cost(input_tokens=input_tokens, output_token=output_tokens)
 
         total_tokens = input_tokens + output_tokens
 
-        costcontroller.record_spending(user, actual_cost)
+        await costcontroller.settle(reservation, actual_cost)
+        mark_stage("cost_record")
 
         record_requst(
-            backend=BACKEND,
+            backend=backend_id,
             user=user,
             model=MODEL_NAME,
             status="200",
@@ -392,15 +579,21 @@ async def generate_text(payload: dict):
             tokens_in=input_tokens,
             tokens_out=output_tokens
         )
-        logger.info(
-            f"Request completd: user={user}, latency={latency:.2f}, tokens={total_tokens}"
+        log_request(
+            user=user, status=200, backend=backend_id, model=MODEL_NAME, stream=False,
+            latency=round(latency, 4), input_tokens=input_tokens, output_tokens=output_tokens,
+            cost=actual_cost if charge_cost else 0.0, cached=cache_hit, coalesced=coalesced,
+            filtered=not output_safety["safe"]
         )
+        mark_stage("metrics")
 
-        return {
-            "backend": BACKEND,
+        # pre-encoded: skips jsonable_encoder and the response model pass
+        return FastJSONResponse({
+            "backend": backend_id,
             "model": MODEL_NAME,
             "user": user,
-            "generated_text": generated_text,
+            "generated_text": output_text,
+            "cached": cache_hit,
             "metrics": {
                 "latency_seconds": round(latency, 3),
                 "input_tokens": input_tokens,
@@ -408,24 +601,166 @@ async def generate_text(payload: dict):
                 "total_tokens": total_tokens,
                 "max_tokens": max_tokens
             }
-        }
-    except requests.RequestException as e:
-        logger.error(f"Request failed: {e}")
+        })
+    except (QueueFullError, NoBackendAvailable) as e:
         record_requst(BACKEND, user, MODEL_NAME, "503", time.time() - start_time)
+        log_request(logging.WARNING, user=user, status=503, backend=BACKEND, model=MODEL_NAME, stream=False,
+                    latency=round(time.time() - start_time, 4), error=str(e))
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server busy : {str(e)}"
+        )
+    except httpx.HTTPError as e:
+        backend_id = getattr(e, "backend_id", BACKEND)
+        record_requst(backend_id, user, MODEL_NAME, "503", time.time() - start_time)
+        log_request(logging.ERROR, user=user, status=503, backend=backend_id, model=MODEL_NAME, stream=False,
+                    latency=round(time.time() - start_time, 4), error=str(e) or type(e).__name__)
         raise HTTPException(
             status_code=503,
             detail=f"Model service unavailable : {str(e)}"
         )
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
         record_requst(BACKEND, user, MODEL_NAME, "500", time.time() - start_time)
+        log_request(logging.ERROR, user=user, status=500, backend=BACKEND, model=MODEL_NAME, stream=False,
+                    latency=round(time.time() - start_time, 4), error=repr(e), exc_info=True)
         raise HTTPException(
             status_code=5003,
             detail=f"internal server error: {str(e)}"
         )
     finally:
+        # no-op once settled
+        await costcontroller.release(reservation)
+        ACTIVE_REQUESTS.dec()
+
+
+async def _stream_generation(user: str, prompt: str, max_tokens: int, temperature: float,
+                             reservation: Optional[Reservation] = None) -> AsyncIterator[str]:
+    ACTIVE_REQUESTS.inc()
+    start_time = time.time()
+    first_token_at = None
+    output_filter = StreamingOutputFilter(content_filter)
+    generated = []
+    backend_id = BACKEND
+    backend_started = False
+
+    ollama_payload = {
+        "model": MODEL_NAME,
+        "prompt": prompt,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+
+    try:
+        # a stream holds a scheduler slot for its whole length, like a queued generation
+        async with scheduler.slot(user), aclosing(router.stream_generate(ollama_payload)) as chunks:
+            backend_started = True
+            async for chunk, backend_id in chunks:
+                piece = output_filter.feed(chunk.get("response", ""))
+                if output_filter.violation:
+                    break
+                if piece:
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                        TIME_TO_FIRST_TOKEN.labels(backend=backend_id, model=MODEL_NAME).observe(first_token_at - start_time)
+                    generated.append(piece)
+                    yield dumps({"response": piece, "done": False}) + "\n"
+                if chunk.get("done"):
+                    break
+
+        mark_stage("backend_stream")
+
+        if not output_filter.violation:
+            piece = output_filter.flush()
+            if piece:
+                generated.append(piece)
+                yield dumps({"response": piece, "done": False}) + "\n"
+
+        if output_filter.violation:
+            SAFETY_VIOLATION.labels(
+                violation_type="output_filter",
+                severity=output_filter.violation["severity"]
+            ).inc()
+            yield dumps({"response": FILTERED_OUTPUT, "filtered": True, "done": False}) + "\n"
+
+        latency = time.time() - start_time
+        generated_text = "".join(generated)
+        input_tokens = _count_tokens(prompt)
+        output_tokens = await token_counter.count_async(generated_text)
+        mark_stage("recount")
+
+        actual_cost = costcontroller.calculate_cost(input_tokens=input_tokens, output_token=output_tokens)
+        await costcontroller.settle(reservation, actual_cost)
+        mark_stage("cost_record")
+
+        record_requst(
+            backend=backend_id,
+            user=user,
+            model=MODEL_NAME,
+            status="200",
+            latency=latency,
+            tokens_in=input_tokens,
+            tokens_out=output_tokens
+        )
+        log_request(
+            user=user, status=200, backend=backend_id, model=MODEL_NAME, stream=True,
+            latency=round(latency, 4), ttft=round(first_token_at - start_time, 4) if first_token_at else None,
+            input_tokens=input_tokens, output_tokens=output_tokens, cost=actual_cost,
+            filtered=output_filter.violation is not None
+        )
+        mark_stage("metrics")
+
+        yield dumps({
+            "done": True,
+            "backend": backend_id,
+            "model": MODEL_NAME,
+            "user": user,
+            "metrics": {
+                "latency_seconds": round(latency, 3),
+                "time_to_first_token_seconds": round(first_token_at - start_time, 3) if first_token_at else None,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+                "max_tokens": max_tokens
+            }
+        }) + "\n"
+    except QueueFullError as e:
+        record_requst(BACKEND, user, MODEL_NAME, "503", time.time() - start_time)
+        log_request(logging.WARNING, user=user, status=503, backend=BACKEND, model=MODEL_NAME, stream=True,
+                    latency=round(time.time() - start_time, 4), error=str(e))
+        yield dumps({"error": f"Server busy : {str(e)}", "done": True}) + "\n"
+    except (GeneratorExit, asyncio.CancelledError):
+        # client went away mid-stream: charge what was generated and sent so far.
+        # Counted inline, no awaits before the settle: the task may be cancelled
+        latency = time.time() - start_time
+        input_tokens = _count_tokens(prompt) if backend_started else 0
+        output_tokens = _count_tokens("".join(generated))
+        actual_cost = costcontroller.calculate_cost(input_tokens=input_tokens, output_token=output_tokens)
+        record_requst(backend_id, user, MODEL_NAME, "499", latency, input_tokens, output_tokens)
+        log_request(logging.WARNING, user=user, status=499, backend=backend_id, model=MODEL_NAME, stream=True,
+                    latency=round(latency, 4), input_tokens=input_tokens, output_tokens=output_tokens,
+                    cost=actual_cost, error="client disconnected")
+        settling, reservation = reservation, None
+        # shielded, so the charge lands even when this task is cancelled again
+        await asyncio.shield(costcontroller.settle(settling, actual_cost))
+        raise
+    except (httpx.HTTPError, NoBackendAvailable) as e:
+        # headers are already sent, so the error goes in the stream
+        backend_id = getattr(e, "backend_id", backend_id)
+        record_requst(backend_id, user, MODEL_NAME, "503", time.time() - start_time)
+        log_request(logging.ERROR, user=user, status=503, backend=backend_id, model=MODEL_NAME, stream=True,
+                    latency=round(time.time() - start_time, 4), error=str(e) or type(e).__name__)
+        yield dumps({"error": f"Model service unavailable : {str(e)}", "done": True}) + "\n"
+    except Exception as e:
+        record_requst(backend_id, user, MODEL_NAME, "500", time.time() - start_time)
+        log_request(logging.ERROR, user=user, status=500, backend=backend_id, model=MODEL_NAME, stream=True,
+                    latency=round(time.time() - start_time, 4), error=repr(e), exc_info=True)
+        yield dumps({"error": f"internal server error: {str(e)}", "done": True}) + "\n"
+    finally:
+        # also runs when the client disconnects mid-stream
+        await costcontroller.release(reservation)
         ACTIVE_REQUESTS.dec()
 
+
 if __name__ == "main":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -1,5 +1,14 @@
+import os
+
 from prometheus_client import Counter, Histogram, Gauge, Info
 
+from app.cardinality import MetricsRecorder
+
+
+# set for uvicorn --workers N: values live in mmap files shared by all workers,
+# see app/exposition.py. Gauges pick how worker values are merged.
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
 
 REQUEST_COUNT = Counter(
     "llm_requests_total",
@@ -14,9 +23,16 @@ REQUEST_LATENCY = Histogram(
     ["backend", "model"]
 )
 
+TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time until the first streamed token is sent",
+    ["backend", "model"]
+)
+
 ACTIVE_REQUESTS = Gauge(
     "llm_active_requests",
-    "Current processing requests"
+    "Current processing requests",
+    multiprocess_mode="livesum"
 )
 
 
@@ -36,7 +52,8 @@ OUTPUT_TOKENS = Counter(
 TOKENS_PER_SECOND = Gauge(
     "llm_tokens_per_second",
     "Current token generation rate",
-    ["backend", "model"]
+    ["backend", "model"],
+    multiprocess_mode="livemostrecent"
 )
 
 
@@ -95,21 +112,168 @@ COST_BLOCKED_REQUEST = Counter(
 
 # Helper func
 def record_requst(backend, user, model, status, latency, tokens_in=0, tokens_out=0):
-    REQUEST_COUNT.labels(
-        backend = backend,
-        user = user,
-        status= status,
-        model = model
-    ).inc()
+    # label children are cached and the user label is capped, see app/cardinality.py
+    metrics_recorder.record(backend, user, model, status, latency, tokens_in, tokens_out)
+
+
+def count_user(metric, user, amount=1, **labels):
+    metrics_recorder.count_user(metric, user, amount, **labels)
+
+
+metrics_recorder = MetricsRecorder(
+    REQUEST_COUNT, REQUEST_LATENCY, INPUT_TOKENS, OUTPUT_TOKENS, TOKENS_PER_SECOND,
+    drop_series=not MULTIPROCESS
+)
+
+# Response cache metrics
+CACHE_HITS = Counter(
+    "llm_response_cache_hits_total",
+    "Generations served from the response cache"
+)
+
+CACHE_MISSES = Counter(
+    "llm_response_cache_misses_total",
+    "Cacheable generations not found in the response cache"
+)
+
+CACHE_EVICTIONS = Counter(
+    "llm_response_cache_evictions_total",
+    "Response cache evictions",
+    ["reason"]
+)
+
+CACHE_SIZE_BYTES = Gauge(
+    "llm_response_cache_size_bytes",
+    "Approximate size of the response cache",
+    multiprocess_mode="livesum"
+)
+
+COALESCED_REQUESTS = Counter(
+    "llm_coalesced_requests_total",
+    "Requests that shared an in-flight generation instead of calling the backend"
+)
+
+
+# Scheduler / admission control metrics
+QUEUE_DEPTH = Gauge(
+    "llm_queue_depth",
+    "Generations waiting for a backend slot",
+    multiprocess_mode="livesum"
+)
+
+QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds",
+    "Time a generation waited in the scheduler queue",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+QUEUE_REJECTED = Counter(
+    "llm_queue_rejected_total",
+    "Generations rejected because the scheduler queue was full"
+)
 
+SCHEDULER_INFLIGHT = Gauge(
+    "llm_scheduler_inflight",
+    "Backend calls currently dispatched by the scheduler",
+    multiprocess_mode="livesum"
+)
+
+
+# Startup / warm-up metrics
+STARTUP_PHASE_SECONDS = Gauge(
+    "llm_startup_phase_seconds",
+    "Time spent in each startup and warm-up phase",
+    ["phase"],
+    multiprocess_mode="livemax"
+)
+
+SERVICE_READY = Gauge(
+    "llm_service_ready",
+    "1 once background warm-up has finished",
+    multiprocess_mode="livemin"
+)
+
+
+# Backend health probe metrics
+BACKEND_UP = Gauge(
+    "llm_backend_up",
+    "1 if the last health probe of the backend succeeded",
+    ["backend"],
+    multiprocess_mode="livemostrecent"
+)
+
+BACKEND_PROBE_LATENCY = Gauge(
+    "llm_backend_probe_latency_seconds",
+    "Latency of the last backend health probe",
+    ["backend"],
+    multiprocess_mode="livemostrecent"
+)
+
+BACKEND_PROBE_ERROR_RATE = Gauge(
+    "llm_backend_probe_error_rate",
+    "Share of failed probes over the rolling probe window",
+    ["backend"],
+    multiprocess_mode="livemostrecent"
+)
+
+# computed on scrape with set_function, which the mmap files can't hold:
+# in multiprocess mode the scraped worker reports its own value
+BACKEND_PROBE_AGE = Gauge(
+    "llm_backend_probe_age_seconds",
+    "Seconds since the last backend health probe",
+    ["backend"],
+    multiprocess_mode="liveall"
+)
 
-    REQUEST_LATENCY.labels(backend=backend, model=model).observe(latency)
 
-    if tokens_in > 0:
-        INPUT_TOKENS.labels(backend=backend, user=user, model=model).inc(tokens_in)
-    if tokens_out > 0:
-        OUTPUT_TOKENS.labels(backend=backend, user=user, model=model).inc(tokens_out)
+# Backend router metrics
+BACKEND_OUTSTANDING = Gauge(
+    "llm_backend_outstanding_requests",
+    "Generations in flight per backend",
+    ["backend"],
+    multiprocess_mode="livesum"
+)
+
+BACKEND_EJECTIONS = Counter(
+    "llm_backend_ejections_total",
+    "Times a backend was taken out of rotation after repeated failures",
+    ["backend"]
+)
+
+
+# Circuit breaker / hedging metrics
+CIRCUIT_BREAKER_STATE = Gauge(
+    "llm_circuit_breaker_state",
+    "Breaker state per backend (0 closed, 1 half-open, 2 open)",
+    ["backend"],
+    multiprocess_mode="livemax"
+)
+
+CIRCUIT_BREAKER_TRANSITIONS = Counter(
+    "llm_circuit_breaker_transitions_total",
+    "Breaker state changes",
+    ["backend", "state"]
+)
 
-    total_tokens = tokens_in + tokens_out
-    if latency>0 and total_tokens>0:
-        TOKENS_PER_SECOND.labels(backend=backend, model=model).set(total_tokens / latency)
\ No newline at end of file
+HEDGED_REQUESTS = Counter(
+    "llm_hedged_requests_total",
+    "Hedged generations by outcome",
+    ["outcome"]
+)
+
+
+# Logging
+LOG_RECORDS_DROPPED = Counter(
+    "llm_log_records_dropped_total",
+    "Log records not written, sampled out or dropped on a full queue",
+    ["reason"]
+)
+
+
+# Per-stage latency of /generate, see app/spans.py
+STAGE_LATENCY = Histogram(
+    "llm_stage_latency_seconds",
+    "Time spent in each stage of the /generate pipeline",
+    ["stage"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
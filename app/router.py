@@ -0,0 +1,304 @@
+import asyncio
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from app.backend import BackendClient
+from app.breaker import BREAKER_FAILURE_RATE, BREAKER_MIN_REQUESTS, BREAKER_WINDOW, CircuitBreaker
+from app.health import BackendHealthPoller
+from app.metrics import BACKEND_EJECTIONS, BACKEND_OUTSTANDING, HEDGED_REQUESTS
+
+
+# "id=http://host:port,id2=http://host2:port" ; a bare url uses host:port as id
+OLLAMA_BACKENDS = os.getenv("OLLAMA_BACKENDS", "")
+# least_outstanding | ewma
+ROUTER_STRATEGY = os.getenv("ROUTER_STRATEGY", "least_outstanding")
+# consecutive failures before ejection. The default is the most the breaker can
+# take to open (a full window of successes, then failures up to the rate), so
+# the breaker always trips first and ejection is the probe-gated backstop
+ROUTER_EJECT_AFTER = int(os.getenv(
+    "ROUTER_EJECT_AFTER", str(max(BREAKER_MIN_REQUESTS, math.ceil(BREAKER_FAILURE_RATE * BREAKER_WINDOW)))
+))
+ROUTER_EJECT_SECONDS = float(os.getenv("ROUTER_EJECT_SECONDS", "30"))
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.3"))
+# hedging: after the primary backend's p95 latency, race a second backend
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "2.0"))
+
+
+class NoBackendAvailable(Exception):
+    pass
+
+
+class Backend:
+    """One model host with its own connection pool, poller, breaker and load stats."""
+
+    def __init__(self, backend_id: str, url: str):
+        self.id = backend_id
+        self.url = url
+        self.client = BackendClient(url)
+        self.poller = BackendHealthPoller(self.client, backend_id)
+        self.breaker = CircuitBreaker(backend_id)
+
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.latencies = deque(maxlen=200)
+        self.consecutive_failures = 0
+        self.ejected_at: Optional[float] = None
+
+    def available(self, now: float, eject_seconds: float) -> bool:
+        if self.ejected_at is not None:
+            # back in rotation once ejected long enough and a later probe passed
+            probed_after = self.poller.last_probe_at is not None and self.poller.last_probe_at > self.ejected_at
+            if now - self.ejected_at < eject_seconds or not (probed_after and self.poller.healthy):
+                return False
+            self.ejected_at = None
+            self.consecutive_failures = 0
+        if not self.breaker.available():
+            return False
+        # not probed yet counts as healthy, the first request will tell
+        return self.poller.last_probe_at is None or self.poller.healthy
+
+    def p95_latency(self, min_samples: int) -> Optional[float]:
+        if len(self.latencies) < min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def observe(self, latency: float, alpha: float):
+        self.latencies.append(latency)
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = alpha * latency + (1 - alpha) * self.ewma_latency
+
+
+def parse_backends(spec: str, default_url: str) -> List[Tuple[str, str]]:
+    backends = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        if "=" in item:
+            backend_id, url = item.split("=", 1)
+        else:
+            url = item
+            backend_id = httpx.URL(url).netloc.decode()
+        backends.append((backend_id.strip(), url.strip()))
+    return backends or [("ollama", default_url)]
+
+
+class BackendRouter:
+    """Spreads generations over several Ollama hosts.
+
+    least_outstanding picks the backend with the fewest requests in flight.
+    ewma weighs that by the smoothed latency (ewma * (outstanding + 1)), so
+    a slow host gets less traffic before it piles up. Ties are broken at
+    random. Each backend has a CircuitBreaker, which opens on the error
+    rate; with every breaker open, select() fails fast with
+    NoBackendAvailable. A backend still failing after eject_after
+    consecutive failures (by default after its breaker opened) is
+    ejected: it comes back once eject_seconds have passed and a later
+    health probe succeeds.
+
+    With hedging on, a request still running after the primary's p95
+    latency is also sent to a second backend. The first reply wins and the
+    other call is cancelled.
+    """
+
+    def __init__(
+        self,
+        backends: Sequence[Tuple[str, str]],
+        strategy: str = ROUTER_STRATEGY,
+        eject_after: int = ROUTER_EJECT_AFTER,
+        eject_seconds: float = ROUTER_EJECT_SECONDS,
+        ewma_alpha: float = ROUTER_EWMA_ALPHA,
+        hedge: bool = HEDGE_ENABLED,
+        hedge_min_samples: int = HEDGE_MIN_SAMPLES,
+        hedge_default_delay: float = HEDGE_DEFAULT_DELAY,
+    ):
+        self.backends: Dict[str, Backend] = {bid: Backend(bid, url) for bid, url in backends}
+        self.strategy = strategy
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.ewma_alpha = ewma_alpha
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_default_delay = hedge_default_delay
+
+    def _score(self, backend: Backend, default_latency: float) -> float:
+        if self.strategy == "ewma":
+            latency = backend.ewma_latency if backend.ewma_latency is not None else default_latency
+            # the tiny outstanding term still spreads load while latencies are unknown
+            return latency * (backend.outstanding + 1) + backend.outstanding * 1e-9
+        return float(backend.outstanding)
+
+    def select(self, exclude: Sequence[str] = ()) -> Backend:
+        now = time.monotonic()
+        candidates = [
+            b for b in self.backends.values()
+            if b.id not in exclude and b.available(now, self.eject_seconds)
+        ]
+        if not candidates:
+            raise NoBackendAvailable("no healthy generation backend available")
+
+        # backends without a latency sample yet are assumed to be average
+        known = [b.ewma_latency for b in candidates if b.ewma_latency is not None]
+        default_latency = sum(known) / len(known) if known else 0.0
+        scores = [self._score(b, default_latency) for b in candidates]
+        best = min(scores)
+        return random.choice([b for b, score in zip(candidates, scores) if score == best])
+
+    def _acquire(self, backend: Backend):
+        backend.breaker.acquire()
+        backend.outstanding += 1
+        BACKEND_OUTSTANDING.labels(backend=backend.id).set(backend.outstanding)
+
+    def _release(self, backend: Backend):
+        backend.outstanding -= 1
+        BACKEND_OUTSTANDING.labels(backend=backend.id).set(backend.outstanding)
+
+    def _success(self, backend: Backend, latency: float):
+        backend.consecutive_failures = 0
+        backend.breaker.record_success()
+        backend.observe(latency, self.ewma_alpha)
+
+    def _failure(self, backend: Backend):
+        backend.breaker.record_failure()
+        backend.consecutive_failures += 1
+        if backend.ejected_at is None and backend.consecutive_failures >= self.eject_after:
+            backend.ejected_at = time.monotonic()
+            BACKEND_EJECTIONS.labels(backend=backend.id).inc()
+
+    async def _call(self, backend: Backend, payload: Dict) -> Tuple[Dict, str]:
+        self._acquire(backend)
+        started = time.monotonic()
+        try:
+            result = await backend.client.generate(payload)
+        except httpx.HTTPError as e:
+            self._failure(backend)
+            e.backend_id = backend.id
+            raise
+        except asyncio.CancelledError:
+            backend.breaker.release()
+            raise
+        except Exception:
+            # e.g. a body that is not JSON: still an outcome, or a half-open probe never comes back
+            self._failure(backend)
+            raise
+        finally:
+            self._release(backend)
+        self._success(backend, time.monotonic() - started)
+        return result, backend.id
+
+    async def generate(self, payload: Dict) -> Tuple[Dict, str]:
+        primary = self.select()
+        if not self.hedge or len(self.backends) < 2:
+            return await self._call(primary, payload)
+        return await self._hedged(primary, payload)
+
+    async def _hedged(self, primary: Backend, payload: Dict) -> Tuple[Dict, str]:
+        delay = primary.p95_latency(self.hedge_min_samples) or self.hedge_default_delay
+        first = asyncio.ensure_future(self._call(primary, payload))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return first.result()
+
+            try:
+                secondary = self.select(exclude=[primary.id])
+            except NoBackendAvailable:
+                return await first
+            HEDGED_REQUESTS.labels(outcome="sent").inc()
+            second = asyncio.ensure_future(self._call(secondary, payload))
+            tasks.append(second)
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        HEDGED_REQUESTS.labels(outcome="hedge_won" if task is second else "primary_won").inc()
+                        return task.result()
+                    error = task.exception()
+            HEDGED_REQUESTS.labels(outcome="both_failed").inc()
+            raise error
+        finally:
+            # also when the caller is cancelled: no call outlives the request,
+            # and every outcome is retrieved
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def stream_generate(self, payload: Dict) -> AsyncIterator[Tuple[Dict, str]]:
+        # streams are not hedged: tokens may already be on their way to the client
+        backend = self.select()
+        self._acquire(backend)
+        started = time.monotonic()
+        finished = False
+        try:
+            async for chunk in backend.client.stream_generate(payload):
+                if chunk.get("done") and not finished:
+                    # recorded before the yield: consumers close the stream on the done chunk
+                    finished = True
+                    self._success(backend, time.monotonic() - started)
+                yield chunk, backend.id
+        except httpx.HTTPError as e:
+            if not finished:
+                self._failure(backend)
+            e.backend_id = backend.id
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            # the client went away mid-stream, no outcome for the backend
+            if not finished:
+                backend.breaker.release()
+            raise
+        except Exception:
+            if not finished:
+                self._failure(backend)
+            raise
+        finally:
+            self._release(backend)
+        if not finished:
+            self._success(backend, time.monotonic() - started)
+
+    async def start(self):
+        for backend in self.backends.values():
+            await backend.client.start()
+
+    def start_polling(self):
+        for backend in self.backends.values():
+            backend.poller.start()
+
+    async def probe_all(self) -> bool:
+        results = await asyncio.gather(*(b.poller.probe_once() for b in self.backends.values()))
+        return any(results)
+
+    async def close(self):
+        for backend in self.backends.values():
+            await backend.poller.stop()
+            await backend.client.close()
+
+    def healthy(self) -> bool:
+        now = time.monotonic()
+        return any(b.available(now, self.eject_seconds) and b.poller.healthy for b in self.backends.values())
+
+    def snapshot(self) -> List[Dict]:
+        out = []
+        for b in self.backends.values():
+            state = b.poller.snapshot()
+            state.update({
+                "url": b.url,
+                "outstanding": b.outstanding,
+                "ewma_latency_seconds": round(b.ewma_latency, 4) if b.ewma_latency is not None else None,
+                "ejected": b.ejected_at is not None,
+                "circuit": b.breaker.state
+            })
+            out.append(state)
+        return out
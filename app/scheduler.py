@@ -0,0 +1,214 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, List, Optional
+
+from app.metrics import QUEUE_DEPTH, QUEUE_REJECTED, QUEUE_WAIT, SCHEDULER_INFLIGHT
+
+
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "256"))
+SCHEDULER_MAX_INFLIGHT = int(os.getenv("SCHEDULER_MAX_INFLIGHT", "8"))
+# micro-batching only kicks in when a batch_runner is given
+SCHEDULER_BATCH_WINDOW_MS = float(os.getenv("SCHEDULER_BATCH_WINDOW_MS", "0"))
+SCHEDULER_MAX_BATCH = int(os.getenv("SCHEDULER_MAX_BATCH", "8"))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ("user", "payload", "future", "enqueued_at")
+
+    def __init__(self, user: str, payload: Any, future: asyncio.Future):
+        self.user = user
+        self.payload = payload
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class _Lease:
+    # payload of a slot() job: the slot is held until `released` is set
+    __slots__ = ("released",)
+
+    def __init__(self):
+        self.released = asyncio.Event()
+
+
+class Scheduler:
+    """Admission control between /generate and the backend.
+
+    Jobs wait in a bounded queue split per user. A dispatcher hands them
+    out round-robin across users, so a user with a deep queue gets one turn
+    per round like everyone else, and at most max_inflight run at once. If
+    a batch_runner is set, the dispatcher waits up to batch_window for more
+    jobs and sends up to max_batch payloads in a single call.
+
+    slot() queues the same way but hands the slot to the caller for the
+    length of a block, for work that runs outside the runner (streams).
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[Any], Awaitable[Any]],
+        batch_runner: Optional[Callable[[List[Any]], Awaitable[List[Any]]]] = None,
+        max_queue: int = SCHEDULER_MAX_QUEUE,
+        max_inflight: int = SCHEDULER_MAX_INFLIGHT,
+        batch_window: float = SCHEDULER_BATCH_WINDOW_MS / 1000.0,
+        max_batch: int = SCHEDULER_MAX_BATCH,
+    ):
+        self.runner = runner
+        self.batch_runner = batch_runner
+        self.max_queue = max_queue
+        self.max_inflight = max_inflight
+        self.batch_window = batch_window
+        self.max_batch = max_batch if batch_runner else 1
+
+        self._queues: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self._pending = 0
+        self._inflight = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return self._pending
+
+    def start(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_inflight)
+            self._dispatcher = asyncio.ensure_future(self._dispatch_loop())
+
+    async def stop(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for queue in self._queues.values():
+            for job in queue:
+                if not job.future.done():
+                    job.future.cancel()
+        self._queues.clear()
+        self._pending = 0
+        QUEUE_DEPTH.set(0)
+
+    async def submit(self, user: str, payload: Any) -> Any:
+        self.start()
+        if self._pending >= self.max_queue:
+            QUEUE_REJECTED.inc()
+            raise QueueFullError(f"generation queue full ({self.max_queue} waiting)")
+
+        job = _Job(user, payload, asyncio.get_running_loop().create_future())
+        queue = self._queues.get(user)
+        if queue is None:
+            queue = deque()
+            self._queues[user] = queue
+        queue.append(job)
+        self._pending += 1
+        QUEUE_DEPTH.set(self._pending)
+        self._wakeup.set()
+
+        return await job.future
+
+    @asynccontextmanager
+    async def slot(self, user: str):
+        lease = _Lease()
+        try:
+            await self.submit(user, lease)
+            yield
+        finally:
+            # also frees a slot granted after the caller gave up
+            lease.released.set()
+
+    def _requeue(self, job: _Job):
+        # back to the head of its user's queue, that user first
+        queue = self._queues.get(job.user)
+        if queue is None:
+            queue = deque()
+            self._queues[job.user] = queue
+        queue.appendleft(job)
+        self._queues.move_to_end(job.user, last=False)
+        self._pending += 1
+        QUEUE_DEPTH.set(self._pending)
+
+    def _next_job(self) -> Optional[_Job]:
+        # round robin: take the head of the first user's queue, send the user to the back
+        while self._queues:
+            user, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            self._pending -= 1
+            QUEUE_DEPTH.set(self._pending)
+            if not job.future.done():  # caller may have gone away while queued
+                return job
+        return None
+
+    async def _dispatch_loop(self):
+        while True:
+            await self._slots.acquire()
+            job = self._next_job()
+            while job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                job = self._next_job()
+
+            batch = [job]
+            # a lease holds its slot on its own, never batched
+            if self.max_batch > 1 and not isinstance(job.payload, _Lease):
+                deadline = time.monotonic() + self.batch_window
+                while len(batch) < self.max_batch:
+                    extra = self._next_job()
+                    if extra is not None and isinstance(extra.payload, _Lease):
+                        self._requeue(extra)
+                        break
+                    if extra is not None:
+                        batch.append(extra)
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+
+            now = time.monotonic()
+            for j in batch:
+                QUEUE_WAIT.observe(now - j.enqueued_at)
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[_Job]):
+        self._inflight += 1
+        SCHEDULER_INFLIGHT.set(self._inflight)
+        try:
+            if isinstance(batch[0].payload, _Lease):
+                if not batch[0].future.done():
+                    batch[0].future.set_result(None)
+                await batch[0].payload.released.wait()
+                results = []
+            elif len(batch) == 1 and self.batch_runner is None:
+                results = [await self.runner(batch[0].payload)]
+            else:
+                results = await self.batch_runner([j.payload for j in batch])
+            for job, result in zip(batch, results):
+                if not job.future.done():
+                    job.future.set_result(result)
+        except Exception as e:
+            for job in batch:
+                if not job.future.done():
+                    job.future.set_exception(e)
+        finally:
+            self._inflight -= 1
+            SCHEDULER_INFLIGHT.set(self._inflight)
+            self._slots.release()
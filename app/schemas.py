@@ -0,0 +1,68 @@
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, field_validator
+
+try:
+    import orjson  # optional, C/Rust JSON encoder
+except ImportError:
+    orjson = None
+
+
+class GenerateRequest(BaseModel):
+    """Shape and normalisation of a /generate body; business limits live in Guardrails."""
+
+    user: str = "anyonymous"
+    prompt: str = ""
+    max_tokens: int = 50
+    temperature: float = 0.7
+    stream: bool = False
+
+    @field_validator("prompt")
+    @classmethod
+    def _strip_prompt(cls, value: str) -> str:
+        return value.strip()
+
+    @field_validator("temperature")
+    @classmethod
+    def _clamp_temperature(cls, value: float) -> float:
+        return max(0.0, min(2.0, value))
+
+
+class GenerateMetrics(BaseModel):
+    latency_seconds: float
+    input_tokens: int
+    output_tokens: int
+    total_tokens: int
+    max_tokens: int
+
+
+class GenerateResponse(BaseModel):
+    backend: str
+    model: str
+    user: str
+    generated_text: str
+    cached: bool
+    metrics: GenerateMetrics
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with orjson when installed, compact stdlib json otherwise.
+
+    Handlers return it directly with a plain dict, which skips FastAPI's
+    jsonable_encoder / response-model pass; response_model on the route is
+    then only used for the OpenAPI schema.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(content: Any) -> str:
+    # NDJSON lines of the streaming endpoint
+    if orjson is not None:
+        return orjson.dumps(content).decode()
+    return json.dumps(content)
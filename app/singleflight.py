@@ -0,0 +1,44 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from app.metrics import COALESCED_REQUESTS
+
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one upstream call.
+
+    The first caller starts the work as its own task and later callers with
+    the same key await that task. The task is shielded, so a disconnecting
+    client does not cancel the generation for everyone else. Callers only
+    coalesce deterministic settings (temperature at or below
+    RESPONSE_CACHE_MAX_TEMPERATURE); sampled requests each get their own call.
+    """
+
+    def __init__(self, enabled: bool = SINGLEFLIGHT_ENABLED):
+        self.enabled = enabled
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Returns (result, shared) where shared is True for coalesced callers."""
+        if not self.enabled:
+            return await fn(), False
+
+        task = self._inflight.get(key)
+        if task is not None:
+            COALESCED_REQUESTS.inc()
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task), False
+
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+
+singleflight = SingleFlight()
@@ -0,0 +1,88 @@
+import os
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from app.metrics import STAGE_LATENCY
+
+
+# add a Server-Timing header with the stage breakdown to timed responses
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+STAGE_TIMING_PATHS = tuple(p for p in os.getenv("STAGE_TIMING_PATHS", "/generate").split(",") if p)
+
+_current: ContextVar[Optional["StageTimer"]] = ContextVar("stage_timer", default=None)
+_stage_children: Dict[str, object] = {}
+
+
+class StageTimer:
+    """Back-to-back stages of one request.
+
+    mark(name) closes the stage that started at the previous mark (or when
+    the request came in), so the stages always add up to the whole request
+    and there is nothing to open or close. The middleware adds "serialize"
+    (handler return to response headers) and "respond" (body sent).
+    """
+
+    __slots__ = ("started", "stages", "_last")
+
+    def __init__(self):
+        self.started = self._last = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.stages.append((name, now - self._last))
+        self._last = now
+
+    def finish(self):
+        self.mark("respond")
+        for name, seconds in self.stages:
+            child = _stage_children.get(name)
+            if child is None:
+                child = _stage_children[name] = STAGE_LATENCY.labels(stage=name)
+            child.observe(seconds)
+
+    def server_timing(self) -> str:
+        # only what has happened so far: the header goes out before the body
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.stages)
+
+
+def mark_stage(name: str):
+    timer = _current.get()
+    if timer is not None:
+        timer.mark(name)
+
+
+class StageTimingMiddleware:
+    """Plain ASGI middleware (no BaseHTTPMiddleware overhead) that gives each
+    request on `paths` a StageTimer and records its stages when the response
+    is done, streamed bodies included."""
+
+    def __init__(self, app, paths=STAGE_TIMING_PATHS, server_timing: bool = SERVER_TIMING_ENABLED):
+        self.app = app
+        self.paths = paths
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        timer = StageTimer()
+        token = _current.set(timer)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                # handler return -> headers: response model / JSON encoding
+                timer.mark("serialize")
+                if self.server_timing:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", timer.server_timing().encode()))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            timer.finish()
+            _current.reset(token)
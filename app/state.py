@@ -0,0 +1,343 @@
+import asyncio
+import fcntl
+import hashlib
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+
+# memory (per process) | mmap (all workers on one host) | redis (all hosts)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_MMAP_PATH = os.getenv("STATE_MMAP_PATH", "/tmp/llmops_state.bin")
+# one slot per live key: a rate-limit window per active user plus a cost
+# counter per user per day (24h TTL), so at least 2x the daily users
+STATE_MMAP_SLOTS = int(os.getenv("STATE_MMAP_SLOTS", "65536"))
+STATE_REDIS_URL = os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0")
+# store down: "closed" rejects with 503, "open" lets requests through unmetered
+STATE_FAIL_MODE = os.getenv("STATE_FAIL_MODE", "closed")
+
+
+class StateStoreError(Exception):
+    """The store could not be reached or answered with an error."""
+
+
+class StateStore(ABC):
+    """Counter storage for governance state (rate limits, cost budgets).
+
+    Every key is a float counter with an expiry set when the key is
+    created. `incr` is atomic and returns the new value, so a check and an
+    update are one operation no matter how many workers share the store.
+    """
+
+    shared = False
+    # calls do network round trips: keep them off the event loop
+    blocking = False
+
+    @abstractmethod
+    def incr(self, key: str, amount: float, ttl: float) -> float:
+        ...
+
+    @abstractmethod
+    def get(self, key: str) -> float:
+        ...
+
+    def get_many(self, keys: List[str]) -> List[float]:
+        return [self.get(k) for k in keys]
+
+    def incr_and_get(self, key: str, amount: float, ttl: float, read_keys: List[str]) -> Tuple[float, List[float]]:
+        """incr(key) plus the values of read_keys; one round trip on remote stores."""
+        return self.incr(key, amount, ttl), self.get_many(read_keys)
+
+    def close(self):
+        pass
+
+
+class InMemoryStore(StateStore):
+
+    def __init__(self):
+        self._data: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        self._ops = 0
+
+    def incr(self, key: str, amount: float, ttl: float) -> float:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= now:
+                entry = [0.0, now + ttl]
+                self._data[key] = entry
+            entry[0] += amount
+            self._ops += 1
+            if self._ops % 1024 == 0:
+                self._purge(now)
+            return entry[0]
+
+    def get(self, key: str) -> float:
+        entry = self._data.get(key)
+        if entry is None or entry[1] <= time.time():
+            return 0.0
+        return entry[0]
+
+    def _purge(self, now: float):
+        for key in [k for k, e in self._data.items() if e[1] <= now]:
+            del self._data[key]
+
+
+class MmapStore(StateStore):
+    """Fixed-size hash table in a memory-mapped file shared by all workers.
+
+    Each slot is (key hash, expires_at, value) packed into 24 bytes, with
+    linear probing. A key lives within MAX_PROBE slots of its home slot, so
+    a lookup never scans more than that. Expired entries met by an update
+    are removed with backward-shift deletion, which keeps empty slots (the
+    end of a probe) around however many keys come and go. Updates take an
+    flock on the file, which costs a couple of microseconds uncontended.
+    Keys are hashed with blake2b because the builtin hash() is salted per
+    process.
+    """
+
+    shared = True
+    SLOT = struct.Struct("<Qdd")
+    MAX_PROBE = 64
+
+    def __init__(self, path: str = STATE_MMAP_PATH, slots: int = STATE_MMAP_SLOTS):
+        self.path = path
+        self.slots = slots
+        size = slots * self.SLOT.size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, size)
+        self._thread_lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+        return h or 1  # 0 marks an empty slot
+
+    def _slot(self, index: int) -> Tuple[int, float, float]:
+        return self.SLOT.unpack_from(self._mm, index * self.SLOT.size)
+
+    def _find(self, h: int, now: float, create: bool) -> Tuple[Optional[int], bool]:
+        """(slot index of h or where to put it, whether an expired slot was passed)."""
+        start = h % self.slots
+        reusable = None
+        expired = False
+        for i in range(min(self.MAX_PROBE, self.slots)):
+            index = (start + i) % self.slots
+            slot_hash, expires_at, _ = self._slot(index)
+            if slot_hash == h:
+                return index, expired
+            if slot_hash == 0:
+                return (reusable if reusable is not None else index) if create else None, expired
+            if expires_at <= now:
+                expired = True
+                if reusable is None:
+                    reusable = index
+        if create and reusable is None:
+            raise StateStoreError(f"state store {self.path} is full around this key ({self.slots} slots, "
+                                  f"raise STATE_MMAP_SLOTS)")
+        return reusable if create else None, expired
+
+    def _delete(self, index: int):
+        # backward-shift: pull later entries of the run into the hole, so no
+        # probe ever has to look past an empty slot
+        hole = index
+        for _ in range(self.slots - 1):
+            index = (index + 1) % self.slots
+            slot = self._slot(index)
+            if slot[0] == 0:
+                break
+            # movable unless its home slot lies after the hole
+            if (index - slot[0] % self.slots) % self.slots >= (index - hole) % self.slots:
+                self.SLOT.pack_into(self._mm, hole * self.SLOT.size, *slot)
+                hole = index
+        self.SLOT.pack_into(self._mm, hole * self.SLOT.size, 0, 0.0, 0.0)
+
+    def _compact(self, h: int, now: float):
+        start = h % self.slots
+        i = 0
+        while i < min(self.MAX_PROBE, self.slots):
+            index = (start + i) % self.slots
+            slot_hash, expires_at, _ = self._slot(index)
+            if slot_hash == 0:
+                return
+            if expires_at <= now:
+                self._delete(index)  # a later entry may have moved in: look again
+            else:
+                i += 1
+
+    def incr(self, key: str, amount: float, ttl: float) -> float:
+        h = self._hash(key)
+        now = time.time()
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                index, expired = self._find(h, now, create=True)
+                if expired:
+                    self._compact(h, now)
+                    index, _ = self._find(h, now, create=True)
+                slot_hash, expires_at, value = self._slot(index)
+                if slot_hash != h or expires_at <= now:
+                    expires_at, value = now + ttl, 0.0
+                value += amount
+                self.SLOT.pack_into(self._mm, index * self.SLOT.size, h, expires_at, value)
+                return value
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def get(self, key: str) -> float:
+        h = self._hash(key)
+        now = time.time()
+        # flock is per open file, so threads of this process also need the thread lock
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                index, _ = self._find(h, now, create=False)
+                if index is None:
+                    return 0.0
+                slot_hash, expires_at, value = self._slot(index)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if slot_hash != h or expires_at <= now:
+            return 0.0
+        return value
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
+
+
+class RedisStore(StateStore):
+    """Minimal RESP client, enough for counters; no redis package needed.
+
+    Works against Redis or anything that speaks the same protocol
+    (SET NX EX, INCRBYFLOAT, GET, MGET). Every call is one pipelined round
+    trip; connection and protocol errors surface as StateStoreError.
+    """
+
+    shared = True
+    blocking = True
+
+    def __init__(self, url: str = STATE_REDIS_URL, timeout: float = 1.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            if self.db:
+                self._execute([["SELECT", self.db]])
+        return conn
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("state store connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            return [self._read(reader) for _ in range(int(rest))]
+        raise RuntimeError(f"unexpected reply {line!r}")
+
+    def _execute(self, commands):
+        # pipelined: one write, one round trip for all commands
+        try:
+            sock, reader = self._conn()
+            sock.sendall(b"".join(self._encode(c) for c in commands))
+            replies = [self._read(reader) for _ in commands]
+        except (OSError, ConnectionError) as ex:
+            self._local.conn = None
+            raise StateStoreError(f"{self.host}:{self.port}: {ex or type(ex).__name__}") from ex
+        except RuntimeError as ex:
+            # replies after the error are still unread: drop the connection
+            self.close()
+            raise StateStoreError(str(ex)) from ex
+        return replies
+
+    def incr(self, key: str, amount: float, ttl: float) -> float:
+        _, value = self._execute([
+            ["SET", key, 0, "EX", max(1, int(ttl)), "NX"],
+            ["INCRBYFLOAT", key, repr(float(amount))],
+        ])
+        return float(value)
+
+    def incr_and_get(self, key: str, amount: float, ttl: float, read_keys: List[str]) -> Tuple[float, List[float]]:
+        _, value, values = self._execute([
+            ["SET", key, 0, "EX", max(1, int(ttl)), "NX"],
+            ["INCRBYFLOAT", key, repr(float(amount))],
+            ["MGET", *read_keys],
+        ])
+        return float(value), [float(v) if v is not None else 0.0 for v in values]
+
+    def get(self, key: str) -> float:
+        value = self._execute([["GET", key]])[0]
+        return float(value) if value is not None else 0.0
+
+    def get_many(self, keys: List[str]) -> List[float]:
+        values = self._execute([["MGET", *keys]])[0]
+        return [float(v) if v is not None else 0.0 for v in values]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+            self._local.conn = None
+
+
+async def run_store_call(owner, fn, *args):
+    """fn(*args), in a worker thread when `owner` (a store, or a ledger on
+    top of one) does blocking network I/O, inline otherwise."""
+    if owner.blocking:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+def create_state_store(backend: str = STATE_BACKEND) -> StateStore:
+    if backend == "mmap":
+        return MmapStore()
+    if backend == "redis":
+        return RedisStore()
+    return InMemoryStore()
+
+
+state_store = create_state_store()
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+# texts longer than this are counted in a worker thread, off the event loop
+TOKEN_OFFLOAD_CHARS = int(os.getenv("TOKEN_OFFLOAD_CHARS", "4096"))
+
+
+class TokenCounter:
+    """Memoized token counts on top of a tiktoken encoding.
+
+    Counts are cached in a bounded LRU keyed by a blake2b digest of the
+    text, so the prompt counted for the cost estimate is not encoded again
+    after generation. Counting uses encode_ordinary: it skips the special
+    token checks and does not raise on text like "<|endoftext|>". Without
+    an encoding it falls back to a whitespace word count.
+
+    The encoding is loaded by warm(), not at import, since tiktoken may
+    have to download and parse the BPE file (with no timeout). Counting
+    never waits for it: until it is loaded, counts use the fallback, and
+    the first count starts the load in a background thread if warm() has
+    not been called.
+    """
+
+    def __init__(self, encoding_name: str = TOKEN_ENCODING, max_entries: int = TOKEN_CACHE_SIZE):
+        self.encoding_name = encoding_name
+        self.max_entries = max_entries
+        self._encoding = None
+        self._loaded = False
+        self._load_started = False
+        self._load_lock = threading.Lock()
+        self._cache: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def encoding(self):
+        # None while loading: called on the event loop, must not block on the load
+        if not self._loaded:
+            if not self._load_started:
+                self._load_started = True
+                threading.Thread(target=self.warm, name="tokenizer-load", daemon=True).start()
+            return None
+        return self._encoding
+
+    def warm(self) -> bool:
+        """Loads the encoding (blocking); returns False if it could not be loaded."""
+        self._load_started = True
+        with self._load_lock:
+            if not self._loaded:
+                try:
+                    import tiktoken
+                    self._encoding = tiktoken.get_encoding(self.encoding_name)
+                except Exception as e:
+                    logger.warning(f"Could not load tokenizer: {e}")
+                    self._encoding = None
+                self._loaded = True
+        return self._encoding is not None
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    def _lookup(self, key: bytes) -> Optional[int]:
+        with self._lock:
+            count = self._cache.get(key)
+            if count is not None:
+                self._cache.move_to_end(key)
+            return count
+
+    def _store(self, key: bytes, count: int):
+        with self._lock:
+            self._cache[key] = count
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        encoding = self.encoding
+        if encoding is None:
+            return len(text.split())
+
+        key = self._key(text)
+        count = self._lookup(key)
+        if count is None:
+            count = len(encoding.encode_ordinary(text))
+            self._store(key, count)
+        return count
+
+    async def count_async(self, text: str) -> int:
+        if text and len(text) > TOKEN_OFFLOAD_CHARS:
+            return await asyncio.to_thread(self.count, text)
+        return self.count(text)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,102 @@
+"""Cost ledger: overspend under concurrency, shard contention, restart.
+
+1. Many threads reserve against one small budget at once: the old
+   check-then-record path against the reserve path. Reserve never ends
+   over the limit.
+2. reserve + settle throughput from several threads, 1 shard vs many.
+3. Checkpoint, new ledger from the file: today's spending survives.
+
+    python -m benchmarks.cost_ledger
+"""
+import os
+import tempfile
+import threading
+import time
+
+from app.cost import ShardedCostLedger, StoreCostLedger
+from app.state import InMemoryStore
+
+
+LIMIT = 1.0
+COST = 0.01
+
+
+def legacy_overspend(threads: int, attempts: int) -> float:
+    # check_cost_limit then record_spending, with a switch point in between
+    store = InMemoryStore()
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        barrier.wait()
+        for _ in range(attempts):
+            if store.get("cost:u") + COST <= LIMIT:
+                time.sleep(0)
+                store.incr("cost:u", COST, 86400)
+
+    run_threads(worker, threads)
+    return store.get("cost:u")
+
+
+def reserve_overspend(ledger, threads: int, attempts: int) -> float:
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        barrier.wait()
+        for _ in range(attempts):
+            reservation, _ = ledger.reserve("u", COST, LIMIT)
+            if reservation is not None:
+                time.sleep(0)
+                ledger.settle(reservation, COST)
+
+    run_threads(worker, threads)
+    return ledger.spent("u")
+
+
+def run_threads(target, threads: int):
+    workers = [threading.Thread(target=target) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+
+def throughput(shards: int, threads: int, n: int) -> float:
+    ledger = ShardedCostLedger(shards=shards, checkpoint_path="")
+
+    def worker(offset: int):
+        for i in range(n):
+            reservation, _ = ledger.reserve(f"user{(offset + i) % 1000}", COST, 1e9)
+            ledger.settle(reservation, COST)
+
+    workers = [threading.Thread(target=worker, args=(t * 37,)) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return threads * n / (time.perf_counter() - start)
+
+
+def main():
+    threads, attempts = 16, 500
+    print(f"budget ${LIMIT}, {threads} threads x {attempts} attempts of ${COST}")
+    print(f"  check-then-record  spent ${legacy_overspend(threads, attempts):.2f}")
+    sharded = ShardedCostLedger(checkpoint_path="")
+    print(f"  sharded reserve    spent ${reserve_overspend(sharded, threads, attempts):.2f}")
+    print(f"  store reserve      spent ${reserve_overspend(StoreCostLedger(InMemoryStore()), threads, attempts):.2f}")
+
+    for shards in (1, 16):
+        print(f"reserve+settle, {shards:2} shard(s), 8 threads: {throughput(shards, 8, 20_000):10.0f} ops/s")
+
+    path = os.path.join(tempfile.mkdtemp(), "ledger.json")
+    ledger = ShardedCostLedger(checkpoint_path=path)
+    for user in ("alice", "bob"):
+        reservation, _ = ledger.reserve(user, 0.25, LIMIT)
+        ledger.settle(reservation, 0.2)
+    ledger.checkpoint()
+    restarted = ShardedCostLedger(checkpoint_path=path)
+    print(f"after restart: alice ${restarted.spent('alice'):.2f}, bob ${restarted.spent('bob'):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""NLI throughput of FactualConsistencyMetric on CPU, samples/sec.
+
+    legacy    one pipeline call per sample on "premise </s></s> hypothesis"
+              (the old score loop; long premises silently truncated)
+    batched   FactualConsistencyMetric.score: length-sorted batches,
+              long premises split into overlapping chunks
+
+Needs the eval_3 dependencies (transformers, torch, ragas).
+
+    python -m benchmarks.factual_consistency --samples 256 --batch-size 16
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "eval_3"))
+
+from ragas.dataset_schema import SingleTurnSample  # noqa: E402
+from factual_consistency import FactualConsistencyMetric  # noqa: E402
+
+
+FACTS = [
+    "Photosynthesis is the process by which plants convert light energy into chemical energy.",
+    "The water cycle describes how water evaporates, condenses into clouds and falls as rain.",
+    "Mitochondria produce most of the chemical energy that powers a cell.",
+    "The Pacific is the largest and deepest of Earth's oceans.",
+    "Transformers process a sequence with self-attention instead of recurrence.",
+]
+
+PREDICTIONS = [
+    "Plants turn sunlight into chemical energy.",
+    "Water never evaporates.",
+    "Mitochondria power the cell.",
+    "The Atlantic is the largest ocean.",
+    "Transformers rely on self-attention.",
+]
+
+
+def make_samples(n: int, long_share: float, seed: int):
+    rng = random.Random(seed)
+    samples, predictions = [], []
+    for _ in range(n):
+        i = rng.randrange(len(FACTS))
+        contexts = [FACTS[i]]
+        if rng.random() < long_share:
+            # past the 512-token window, the relevant fact at the end
+            contexts = [" ".join(rng.choice(FACTS) for _ in range(40)), FACTS[i]]
+        samples.append(SingleTurnSample(user_input="q", retrieved_contexts=contexts))
+        predictions.append(PREDICTIONS[i])
+    return samples, predictions
+
+
+def legacy_score(metric: FactualConsistencyMetric, samples, predictions) -> float:
+    results = []
+    for sample, pred in zip(samples, predictions):
+        premise = " ".join(sample.retrieved_contexts)
+        label = metric.nli(f"{premise} </s></s> {pred}", truncation=True)[0]["label"]
+        results.append({"CONTRADICTION": 0.0, "NEUTRAL": 0.5}.get(label, 1.0))
+    return sum(results) / len(results)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    value = fn()
+    return value, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--long-share", type=float, default=0.2, help="share of samples over 512 tokens")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    metric = FactualConsistencyMetric(batch_size=args.batch_size)
+    samples, predictions = make_samples(args.samples, args.long_share, args.seed)
+    metric.score(samples[:4], predictions[:4])  # warm-up
+
+    legacy, legacy_s = timed(lambda: legacy_score(metric, samples, predictions))
+    batched, batched_s = timed(lambda: metric.score(samples, predictions)["factual_consistency"])
+    print(f"legacy   {args.samples / legacy_s:8.1f} samples/s  score {legacy:.3f}")
+    print(f"batched  {args.samples / batched_s:8.1f} samples/s  score {batched:.3f}  "
+          f"(batch {args.batch_size}, x{legacy_s / batched_s:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""/metrics scrape time and record cost with 100k distinct users.
+
+"before" is the old record_requst (.labels() per update, one series per
+user), "after" is MetricsRecorder with the top-K user label. Both run on
+their own registry with the same metric definitions and the same traffic:
+a few heavy users plus a long tail of users seen once or twice.
+
+    python -m benchmarks.metrics_cardinality [--users 100000]
+"""
+import argparse
+import random
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+from app.cardinality import MetricsRecorder
+
+
+def declare(registry):
+    return (
+        Counter("llm_requests_total", "", ["backend", "user", "status", "model"], registry=registry),
+        Histogram("llm_request_latency_seconds", "", ["backend", "model"], registry=registry),
+        Counter("llm_input_tokens_total", "", ["backend", "user", "model"], registry=registry),
+        Counter("llm_output_tokens_total", "", ["backend", "user", "model"], registry=registry),
+        Gauge("llm_tokens_per_second", "", ["backend", "model"], registry=registry),
+    )
+
+
+def legacy_recorder(metrics):
+    request_count, request_latency, input_tokens, output_tokens, tokens_per_second = metrics
+
+    def record(backend, user, model, status, latency, tokens_in=0, tokens_out=0):
+        request_count.labels(backend=backend, user=user, status=status, model=model).inc()
+        request_latency.labels(backend=backend, model=model).observe(latency)
+        if tokens_in > 0:
+            input_tokens.labels(backend=backend, user=user, model=model).inc(tokens_in)
+        if tokens_out > 0:
+            output_tokens.labels(backend=backend, user=user, model=model).inc(tokens_out)
+        total_tokens = tokens_in + tokens_out
+        if latency > 0 and total_tokens > 0:
+            tokens_per_second.labels(backend=backend, model=model).set(total_tokens / latency)
+
+    return record
+
+
+def traffic(users: int, seed: int = 7):
+    rng = random.Random(seed)
+    heavy = [f"heavy{i}" for i in range(20)]
+    requests = [f"user{i}" for i in range(users)]
+    requests += [rng.choice(heavy) for _ in range(users)]
+    requests += [f"user{rng.randrange(users)}" for _ in range(users // 2)]
+    rng.shuffle(requests)
+    return requests
+
+
+def run(name: str, record, registry, requests, flush=None):
+    start = time.perf_counter()
+    for i, user in enumerate(requests):
+        record("ollama", user, "tinyllama", "500" if i % 50 == 0 else "200", 0.2, 12, 40)
+    per_record = (time.perf_counter() - start) / len(requests)
+    if flush is not None:
+        flush()
+
+    scrapes = []
+    for _ in range(3):
+        start = time.perf_counter()
+        body = generate_latest(registry)
+        scrapes.append(time.perf_counter() - start)
+    series = sum(1 for line in body.splitlines() if line and not line.startswith(b"#"))
+    print(f"{name:7} record {per_record * 1e6:6.2f} us   scrape {min(scrapes) * 1e3:9.2f} ms   "
+          f"{series:8d} series   {len(body) / 1e6:7.2f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    args = parser.parse_args()
+
+    requests = traffic(args.users)
+    print(f"{len(requests)} requests from {args.users + 20} users")
+
+    registry = CollectorRegistry()
+    run("before", legacy_recorder(declare(registry)), registry, requests)
+
+    registry = CollectorRegistry()
+    recorder = MetricsRecorder(*declare(registry))
+    run("after", recorder.record, registry, requests, recorder.flush)
+    print("top users:", ", ".join(f"{u}={n}" for u, n in recorder.users.top()[:5]), "...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Tiny Redis-protocol stand-in for RedisStore, for local runs without Redis.
+
+Supports PING, SELECT, GET, MGET, SET (EX / NX), INCRBYFLOAT, DEL.
+
+    python -m benchmarks.resp_stub --port 6390
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class RespStub:
+
+    def __init__(self):
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def execute(self, args: List[bytes]) -> bytes:
+        cmd = args[0].upper()
+        if cmd == b"PING":
+            return b"+PONG\r\n"
+        if cmd == b"SELECT":
+            return b"+OK\r\n"
+        if cmd == b"GET":
+            return bulk(self._get(args[1]))
+        if cmd == b"MGET":
+            values = [bulk(self._get(k)) for k in args[1:]]
+            return b"*%d\r\n" % len(values) + b"".join(values)
+        if cmd == b"SET":
+            key, value = args[1], args[2]
+            options = [a.upper() for a in args[3:]]
+            if b"NX" in options and self._get(key) is not None:
+                return b"$-1\r\n"
+            expires_at = None
+            if b"EX" in options:
+                expires_at = time.time() + float(args[3 + options.index(b"EX") + 1])
+            self.data[key] = (value, expires_at)
+            return b"+OK\r\n"
+        if cmd == b"INCRBYFLOAT":
+            key = args[1]
+            current = float(self._get(key) or 0)
+            value = repr(current + float(args[2])).encode()
+            expires_at = self.data[key][1] if key in self.data else None
+            self.data[key] = (value, expires_at)
+            return bulk(value)
+        if cmd == b"DEL":
+            removed = sum(1 for k in args[1:] if self.data.pop(k, None) is not None)
+            return b":%d\r\n" % removed
+        return b"-ERR unknown command\r\n"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                count = int(line[1:-2])
+                args = []
+                for _ in range(count):
+                    length = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self.execute(args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def bulk(value: Optional[bytes]) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+async def serve(host: str, port: int):
+    stub = RespStub()
+    server = await asyncio.start_server(stub.handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
@@ -0,0 +1,205 @@
+"""Router failover against stub backends: ejection, breaker and hedging.
+
+Each check starts in-process stub Ollama servers (their config can be
+changed mid-run) and the service under uvicorn, then asserts:
+
+    eject     a backend that keeps failing is ejected (after its breaker
+              opened and its half-open probes failed), traffic goes to the
+              healthy one, and once it recovers it is back in rotation
+              after ROUTER_EJECT_SECONDS and a passing health probe
+    breaker   a failing backend's breaker opens before the backend is
+              ejected, requests then fail fast with 503, and after
+              BREAKER_OPEN_SECONDS a half-open probe closes it again
+    hedge     with a slow and a fast backend, requests that picked the
+              slow one are answered by the hedge at about the hedge delay
+
+    python -m benchmarks.router_failover [eject breaker hedge]
+"""
+import argparse
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict
+
+import httpx
+
+from benchmarks.loadtest import free_port
+from benchmarks.stub_ollama import Distribution, StubConfig, serve
+
+
+_users = itertools.count()
+
+
+class Stub:
+
+    def __init__(self, latency: float = 0.02, fail_rate: float = 0.0):
+        self.config = StubConfig(latency=latency, fail_rate=fail_rate, tokens=8, seed=1)
+        self.port = free_port()
+        self.server = serve(port=self.port, config=self.config)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def set(self, latency: float = None, fail_rate: float = None):
+        if latency is not None:
+            self.config.latency = Distribution(latency)
+        if fail_rate is not None:
+            self.config.fail_rate = fail_rate
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Service:
+    """The app under uvicorn, pointed at the given stubs."""
+
+    def __init__(self, stubs: Dict[str, Stub], **env: str):
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        full_env = dict(os.environ)
+        full_env.update({
+            "OLLAMA_BACKENDS": ",".join(f"{bid}=http://127.0.0.1:{stub.port}" for bid, stub in stubs.items()),
+            "LOG_LEVEL": "CRITICAL",
+            "COST_CHECKPOINT_PATH": "",
+            "HEALTH_POLL_INTERVAL": "0.2",
+        })
+        full_env.update(env)
+        self.process = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(self.port),
+            "--log-level", "warning", "--no-access-log",
+        ], env=full_env)
+        self.client = httpx.Client(base_url=self.base_url, timeout=30)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            try:
+                if self.client.get("/ready").status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("service did not get ready")
+
+    def generate(self):
+        # a fresh user and prompt per call: no rate limit, cache or coalescing in the way
+        n = next(_users)
+        started = time.perf_counter()
+        response = self.client.post("/generate", json={
+            "user": f"failover-{n}", "prompt": f"Explain neural networks briefly, take {n}",
+            "max_tokens": 8, "temperature": 0.7,
+        })
+        return response, time.perf_counter() - started
+
+    def backends(self) -> Dict[str, Dict]:
+        return {b["backend"]: b for b in self.client.get("/health").json()["backends"]}
+
+    def metric(self, name: str, **labels) -> float:
+        # summed over the series carrying these labels
+        return sum(
+            float(line.rsplit(" ", 1)[1]) for line in self.client.get("/metrics").text.splitlines()
+            if line.startswith(name + "{") and all(f'{k}="{v}"' in line for k, v in labels.items())
+        )
+
+    def stop(self):
+        self.client.close()
+        self.process.terminate()
+        self.process.wait(10)
+
+
+def check(condition: bool, message: str):
+    print(f"  {'ok  ' if condition else 'FAIL'} {message}")
+    if not condition:
+        raise SystemExit(1)
+
+
+def eject():
+    print("eject: a healthy and a failing backend, BREAKER_OPEN_SECONDS=0.2, ROUTER_EJECT_SECONDS=1.5")
+    good, bad = Stub(), Stub(fail_rate=1.0)
+    service = Service({"good": good, "bad": bad}, BREAKER_OPEN_SECONDS="0.2", ROUTER_EJECT_SECONDS="1.5")
+    try:
+        deadline = time.monotonic() + 20
+        while not service.backends()["bad"]["ejected"] and time.monotonic() < deadline:
+            service.generate()
+            time.sleep(0.02)
+        check(service.backends()["bad"]["ejected"], "the failing backend is ejected")
+
+        results = [service.generate()[0] for _ in range(20)]
+        check(all(r.status_code == 200 and r.json()["backend"] == "good" for r in results),
+              "while ejected every request goes to the healthy backend")
+
+        bad.set(fail_rate=0.0)
+        time.sleep(1.8)
+        backends = {service.generate()[0].json()["backend"] for _ in range(20)}
+        check(not service.backends()["bad"]["ejected"], "recovered: back in rotation after eject_seconds and a probe")
+        check(backends == {"good", "bad"}, f"traffic spread over {sorted(backends)} again")
+    finally:
+        service.stop()
+        good.stop()
+        bad.stop()
+
+
+def breaker():
+    print("breaker: one backend, failing every call, BREAKER_OPEN_SECONDS=1")
+    bad = Stub(fail_rate=1.0)
+    service = Service({"bad": bad}, BREAKER_OPEN_SECONDS="1")
+    try:
+        statuses = []
+        while True:
+            response, _ = service.generate()
+            statuses.append(response.status_code)
+            if service.backends()["bad"]["circuit"] == "open" or len(statuses) >= 20:
+                break
+        state = service.backends()["bad"]
+        check(state["circuit"] == "open", f"breaker open after {len(statuses)} failed calls, all 503: {set(statuses)}")
+        check(not state["ejected"], "not ejected yet: the breaker tripped first")
+
+        timings = [service.generate() for _ in range(5)]
+        check(all(r.status_code == 503 for r, _ in timings), "requests while open get 503")
+        slowest = max(t for _, t in timings)
+        check(slowest < 0.1, f"... without calling the backend, slowest {slowest * 1e3:.1f} ms")
+
+        bad.set(fail_rate=0.0)
+        time.sleep(1.2)
+        response, _ = service.generate()
+        check(response.status_code == 200, "after open_seconds the half-open probe goes through")
+        check(service.backends()["bad"]["circuit"] == "closed", "and closes the breaker")
+    finally:
+        service.stop()
+        bad.stop()
+
+
+def hedge():
+    print("hedge: a slow (1 s) and a fast (20 ms) backend, HEDGE_DEFAULT_DELAY=0.1")
+    slow, fast = Stub(latency=1.0), Stub(latency=0.02)
+    service = Service({"slow": slow, "fast": fast}, HEDGE_ENABLED="true", HEDGE_DEFAULT_DELAY="0.1")
+    try:
+        results = [service.generate() for _ in range(10)]
+        check(all(r.status_code == 200 for r, _ in results), "all 200")
+        check(all(r.json()["backend"] == "fast" for r, _ in results), "every answer came from the fast backend")
+        slowest = max(t for _, t in results)
+        check(slowest < 0.5, f"slowest {slowest * 1e3:.0f} ms, well under the slow backend's 1 s")
+        won = service.metric("llm_hedged_requests_total", outcome="hedge_won")
+        check(won > 0, f"hedge won {won:.0f} times")
+        time.sleep(1.1)
+        check(service.backends()["slow"]["outstanding"] == 0, "the losing calls were cancelled")
+    finally:
+        service.stop()
+        slow.stop()
+        fast.stop()
+
+
+CHECKS = {"eject": eject, "breaker": breaker, "hedge": hedge}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("checks", nargs="*", help=f"any of: {', '.join(CHECKS)} (default all)")
+    args = parser.parse_args()
+    for name in args.checks or CHECKS:
+        CHECKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Per-request cost of parsing the /generate body and encoding the reply.
+
+1. Codec paths, same body and reply, called straight through ASGI (no
+   sockets, so only FastAPI and the codec are measured):
+     legacy      payload: dict in, dict out (jsonable_encoder + json.dumps)
+     model       GenerateRequest in, response_model=GenerateResponse out
+     fast        GenerateRequest in, FastJSONResponse(dict) out (what /generate does)
+   plus the share of one core each path costs at 1k-10k RPS.
+2. The real app against the stub backend: parse / serialize stage times
+   from llm_stage_latency_seconds with many requests in flight.
+
+    python -m benchmarks.serialization
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from fastapi import FastAPI
+
+from app.schemas import FastJSONResponse, GenerateRequest, GenerateResponse
+from benchmarks.loadtest import free_port, stage_stats
+
+
+BODY = json.dumps({
+    "user": "alice",
+    "prompt": "Explain the transformer architecture step by step.",
+    "max_tokens": 120,
+    "temperature": 0.2,
+}).encode()
+
+REPLY = {
+    "backend": "ollama",
+    "model": "tinyllama",
+    "user": "alice",
+    "generated_text": "Transformers process a sequence with self-attention layers " * 12,
+    "cached": False,
+    "metrics": {"latency_seconds": 0.412, "input_tokens": 11, "output_tokens": 120,
+                "total_tokens": 131, "max_tokens": 120},
+}
+
+RATES = (1_000, 2_500, 5_000, 10_000)
+
+
+def codec_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/legacy")
+    async def legacy(payload: dict):
+        payload.get("user", "anyonymous"), payload.get("prompt", "").strip()
+        return dict(REPLY)
+
+    @app.post("/model", response_model=GenerateResponse)
+    async def model(payload: GenerateRequest):
+        return dict(REPLY)
+
+    @app.post("/fast", response_model=GenerateResponse, response_class=FastJSONResponse)
+    async def fast(payload: GenerateRequest):
+        return FastJSONResponse(dict(REPLY))
+
+    return app
+
+
+async def asgi_post(app, path: str, body: bytes) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json"),
+                                     (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 1234), "server": ("127.0.0.1", 80),
+    }
+    sent = False
+    status = 0
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.sleep(3600)
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def time_codec(app, path: str, n: int) -> float:
+    for _ in range(200):
+        await asgi_post(app, path, BODY)
+    start = time.perf_counter()
+    for _ in range(n):
+        await asgi_post(app, path, BODY)
+    return (time.perf_counter() - start) / n
+
+
+async def codec_paths(n: int):
+    app = codec_app()
+    print(f"{'path':8} {'us/req':>8} " + " ".join(f"{r / 1000:>4g}k rps" for r in RATES))
+    for path in ("legacy", "model", "fast"):
+        per_request = await time_codec(app, f"/{path}", n)
+        shares = " ".join(f"{per_request * rate:8.1%}" for rate in RATES)
+        print(f"{path:8} {per_request * 1e6:8.1f} {shares}   (share of one core)")
+
+
+async def service(requests: int, concurrency: int):
+    stub_port = free_port()
+    stub = subprocess.Popen([sys.executable, "-m", "benchmarks.stub_ollama",
+                             "--port", str(stub_port), "--latency", "0.005"])
+    # read by app.main at import
+    os.environ.update({
+        "OLLAMA_BACKENDS": f"stub=http://127.0.0.1:{stub_port}",
+        "LOG_LEVEL": "WARNING",
+        "SCHEDULER_MAX_INFLIGHT": str(concurrency),
+    })
+    from prometheus_client import generate_latest
+    from app.main import app
+
+    queue = asyncio.Queue()
+    for i in range(requests):
+        # own user per request: stays under the per-user rate and cost limits
+        queue.put_nowait(json.dumps({"user": f"bench{i}", "prompt": f"What is item {i % 50}?",
+                                     "max_tokens": 16}).encode())
+    statuses = {}
+
+    async def worker():
+        while not queue.empty():
+            status = await asgi_post(app, "/generate", queue.get_nowait())
+            statuses[status] = statuses.get(status, 0) + 1
+
+    try:
+        await asyncio.sleep(0.5)
+        async with app.router.lifespan_context(app):
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+    finally:
+        stub.terminate()
+
+    stages = stage_stats(generate_latest().decode())
+    print(f"\nservice: {requests} requests, {concurrency} in flight, {requests / elapsed:.0f} rps, statuses {statuses}")
+    for name in ("parse", "serialize"):
+        if name in stages:
+            print(f"  {name:10} {stages[name]['mean_ms'] * 1000:8.1f} us/req")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20_000)
+    parser.add_argument("--requests", type=int, default=3_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(codec_paths(args.n))
+    asyncio.run(service(args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
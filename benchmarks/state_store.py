@@ -0,0 +1,82 @@
+"""Per-call latency of the governance state stores.
+
+Starts the RESP stand-in on a free port for the redis case, and checks that
+increments from several processes against the mmap store add up.
+
+    python -m benchmarks.state_store
+"""
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from app.governance import SharedSlidingWindowLimiter
+from app.state import InMemoryStore, MmapStore, RedisStore, StateStoreError
+
+
+def time_store(store, n: int = 20_000) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        store.incr(f"rl:user{i % 500}:1", 1, 120)
+    return (time.perf_counter() - start) / n
+
+
+def time_limiter(store, n: int = 5_000) -> float:
+    # a full shared rate-limit check: one round trip when allowed
+    limiter = SharedSlidingWindowLimiter(store)
+    start = time.perf_counter()
+    for i in range(n):
+        limiter.allow(f"user{i % 500}", 1_000_000, time.time())
+    return (time.perf_counter() - start) / n
+
+
+def _hammer(path: str, n: int):
+    store = MmapStore(path, slots=1024)
+    for _ in range(n):
+        store.incr("shared", 1, 60)
+    store.close()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), "state.bin")
+
+    print(f"memory  incr {time_store(InMemoryStore()) * 1e6:7.2f} us")
+    print(f"mmap    incr {time_store(MmapStore(path)) * 1e6:7.2f} us")
+
+    # atomicity across processes
+    workers, n = 4, 5_000
+    procs = [multiprocessing.Process(target=_hammer, args=(path + ".mp", n)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    total = MmapStore(path + ".mp", slots=1024).get("shared")
+    print(f"mmap    {workers} processes x {n} incr -> {total:.0f} (expected {workers * n})")
+
+    port = free_port()
+    stub = subprocess.Popen([sys.executable, "-m", "benchmarks.resp_stub", "--port", str(port)])
+    try:
+        store = RedisStore(f"redis://127.0.0.1:{port}/0")
+        for _ in range(50):
+            try:
+                store.get("ping")
+                break
+            except StateStoreError:
+                time.sleep(0.1)
+        print(f"resp    incr {time_store(store, 5_000) * 1e6:7.2f} us (python stand-in, real redis is faster)")
+        print(f"resp    rate-limit check {time_limiter(store) * 1e6:7.2f} us")
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Fake Ollama server for local runs without a model.
+
+Implements GET /api/version, GET /api/tags and POST /api/generate (plain and streaming).
+Latency and token rate take a number or a distribution, sampled per request:
+
+    python -m benchmarks.stub_ollama --port 11434 --latency 0.05
+    python -m benchmarks.stub_ollama --latency lognormal:0.05,0.5 --tokens-per-second normal:200,40
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+from typing import Optional, Union
+
+
+WORDS = (
+    "models learn patterns from data and use them to predict the next token "
+    "in a sequence which lets them answer questions summarize text and more"
+).split()
+
+
+class Distribution:
+    """'0.05' or 'const:0.05', 'uniform:lo,hi', 'normal:mean,sd',
+    'lognormal:median,sigma', 'exp:mean'. Samples are clipped at 0."""
+
+    def __init__(self, spec: Union[str, float]):
+        self.spec = str(spec)
+        kind, _, args = self.spec.partition(":")
+        if not args:
+            kind, args = "const", kind
+        self.kind = kind
+        self.args = [float(a) for a in args.split(",")]
+        if kind not in ("const", "uniform", "normal", "lognormal", "exp"):
+            raise ValueError(f"unknown distribution: {self.spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        a = self.args
+        if self.kind == "const":
+            value = a[0]
+        elif self.kind == "uniform":
+            value = rng.uniform(a[0], a[1])
+        elif self.kind == "normal":
+            value = rng.gauss(a[0], a[1])
+        elif self.kind == "lognormal":
+            value = rng.lognormvariate(math.log(a[0]), a[1])
+        else:
+            value = rng.expovariate(1.0 / a[0])
+        return max(0.0, value)
+
+
+class StubConfig:
+
+    def __init__(self, latency: Union[float, str] = 0.05, fail_rate: float = 0.0, tokens: int = 30,
+                 tokens_per_second: Union[float, str] = 0.0, seed: Optional[int] = None):
+        self.latency = Distribution(latency)
+        self.fail_rate = fail_rate
+        self.tokens = tokens
+        self.tokens_per_second = Distribution(tokens_per_second)
+        self.rng = random.Random(seed)
+
+    def answer(self, n: int):
+        return [self.rng.choice(WORDS) for _ in range(n)]
+
+
+def make_handler(config: StubConfig):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/version":
+                self._json(200, {"version": "stub"})
+            elif self.path == "/api/tags":
+                # the eval TinyLlamaInterface checks for its model here
+                self._json(200, {"models": [{"name": "tinyllama:latest"}]})
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if self.path != "/api/generate":
+                self._json(404, {"error": "not found"})
+                return
+
+            if config.rng.random() < config.fail_rate:
+                self._json(500, {"error": "stub failure"})
+                return
+
+            time.sleep(config.latency.sample(config.rng))
+            n = min(int(payload.get("max_tokens", config.tokens)), config.tokens)
+            words = config.answer(n)
+            tokens_per_second = config.tokens_per_second.sample(config.rng)
+            per_token = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+
+            if not payload.get("stream", False):
+                time.sleep(per_token * n)
+                self._json(200, {
+                    "model": payload.get("model", "stub"),
+                    "response": " ".join(words),
+                    "done": True,
+                    "eval_count": n
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, word in enumerate(words):
+                time.sleep(per_token)
+                self._chunk({"response": word + " ", "done": False})
+            self._chunk({"response": "", "done": True, "eval_count": n})
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _chunk(self, body: dict):
+            data = (json.dumps(body) + "\n").encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        # callers hang up mid-reply all the time (hedge losers, timeouts)
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(host: str = "127.0.0.1", port: int = 11434, config: Optional[StubConfig] = None) -> ThreadingHTTPServer:
+    server = _Server((host, port), make_handler(config or StubConfig()))
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", default="0.05")
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--tokens", type=int, default=30)
+    parser.add_argument("--tokens-per-second", default="0")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    config = StubConfig(args.latency, args.fail_rate, args.tokens, args.tokens_per_second, args.seed)
+    serve(args.host, args.port, config).serve_forever()
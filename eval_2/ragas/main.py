@@ -22,17 +22,18 @@ class LLMEvaluatorFramework:
         ground_truths = self.dataset["ground_truth"]
 
 
-        tiny_results= []
         gpt_Results = []
 
+        items = []
         for i, (q, c) in enumerate(zip(question, contexts)):
             ctx = c[0] if isinstance(c, (list, tuple)) and len(c) > 0 else (c if isinstance(c, str) else "")
+            items.append((q, ctx))
             gpt_r = self.gpt.generate_response(q, ctx)
-            tiny_r = self.tiny.genereate_response(q, ctx)
-
-            tiny_results.append(tiny_r)
             gpt_Results.append(gpt_r)
 
+        # concurrent requests over the pooled Ollama session
+        tiny_results = self.tiny.generate_many(items)
+
         # Ragas evalaition
 
         tiny_answers = [r.get("answer") for r in tiny_results]
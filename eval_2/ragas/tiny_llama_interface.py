@@ -1,30 +1,88 @@
+import json
+import os
 import time
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "tinyllama")
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "40"))
+# keep-alive connections, also the most requests generate_many runs at once
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "8"))
+# retried on connection errors and 429/5xx, never after the request was read
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "2"))
+
 
 class TinyLlamaInterface:
-    def __init__(self):
+    """TinyLlama through Ollama's HTTP API (/api/generate) on one pooled session."""
+
+    def __init__(self, base_url: str = OLLAMA_URL, model: str = OLLAMA_MODEL, timeout: float = OLLAMA_TIMEOUT,
+                 pool_size: int = OLLAMA_POOL_SIZE, retries: int = OLLAMA_RETRIES):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.pool_size = pool_size
+        retry = Retry(total=retries, connect=retries, read=0, status=retries, backoff_factor=0.5,
+                      status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset({"GET", "POST"}),
+                      raise_on_status=False)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.available = self._check_ollama()
 
     def _check_ollama(self):
         try:
-            r = subprocess.run(["ollama", "list"], capture_output=True, text=True, timeout=5)
-            return r.returncode == 0 and "tinyllama" in r.stdout
+            r = self.session.get(f"{self.base_url}/api/tags", timeout=5)
+            names = [m.get("name", "") for m in r.json().get("models", [])] if r.ok else []
+            # "tinyllama:latest" counts as "tinyllama"
+            return any(name == self.model or name.startswith(f"{self.model}:") for name in names)
         except Exception:
             return False
-        
-    def genereate_response(self, question: str, context: str = ""):
+
+    def genereate_response(self, question: str, context: str = "", stream: bool = False,
+                           on_token: Optional[Callable[[str], None]] = None):
         if not self.available:
             return {"answer": None, "latency": 0.0, "error": "TinyLlama Unavailable"}
         prompt = f"Context: {context}\n\n Question: {question}\nAnswer:" if context else f"Question: {question}\n Answer:"
+        payload = {"model": self.model, "prompt": prompt, "stream": stream}
         t0 = time.time()
         try:
-            r= subprocess.run(["ollama", "run", "tinyllama", prompt], capture_output=True, text=True, timeout=40)
-            raw = r.stdout.strip() if r.returncode == 0 else None
-            if raw and "Answer:" in raw:
-                raw = raw.split("Answer")[-1].strip()
+            with self.session.post(f"{self.base_url}/api/generate", json=payload,
+                                   timeout=(5, self.timeout), stream=stream) as r:
+                r.raise_for_status()
+                if stream:
+                    parts = []
+                    for line in r.iter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        piece = chunk.get("response", "")
+                        if piece:
+                            parts.append(piece)
+                            if on_token is not None:
+                                on_token(piece)
+                        if chunk.get("done"):
+                            break
+                    raw = "".join(parts)
+                else:
+                    raw = r.json().get("response", "")
+            # the API returns only the completion; drop an "Answer:" the model repeats
+            raw = raw.strip()
+            if raw.startswith("Answer:"):
+                raw = raw[len("Answer:"):].strip()
+            raw = raw or None
             return {"answer": raw, "latency": time.time()-t0, "error": None if raw else "No response"}
-        except subprocess.TimeoutExpired:
-            return {"answer": FileNotFoundError, "latency": time.time()-t0, "error": "Timeout"}
+        except requests.Timeout:
+            return {"answer": None, "latency": time.time()-t0, "error": "Timeout"}
         except Exception as e:
             return {"answer": None, "latency": time.time()-t0, "error": str(e)}
-        
\ No newline at end of file
+
+    def generate_many(self, items: List[Tuple[str, str]], max_workers: Optional[int] = None) -> List[Dict]:
+        """genereate_response for (question, context) pairs, pool_size at a time, in input order."""
+        with ThreadPoolExecutor(max_workers=max_workers or self.pool_size) as pool:
+            return list(pool.map(lambda item: self.genereate_response(*item), items))
@@ -6,6 +6,7 @@ from typing import List
 from ragas.dataset_schema import SingleTurnSample
 from factual_consistency import FactualConsistencyMetric
 from hallucination_detector import HallucinationDetector
+from model_registry import registry
 from tiny_llama_interface import TinyLlamaInterface
 
 
@@ -69,19 +70,21 @@ samples = [
 
 
 llm = TinyLlamaInterface()
+# one set of metrics for the baseline and the adversarial run; models come from the shared registry
+adv_eval = AdversarialEvaluator(llm)
 
 
 predictions = [llm.genereate_response(s.user_input, " ".join(s.retrieved_contexts))["answer"] or "" for s in samples]
-halluc = HallucinationDetector().run(samples, predictions)
-facts = FactualConsistencyMetric().run(samples, predictions)
+halluc = adv_eval.hallu.run(samples, predictions)
+facts = adv_eval.facts.run(samples, predictions)
 
 print("Baseline hallucination: ", halluc)
 print("baseline Factual consistency: ", facts)
 
 
 
-adv_eval = AdversarialEvaluator(llm)
 adv_results = adv_eval.run(samples)
 
 print("Adversarial results: ", adv_results)
+print(registry.report())
 
@@ -1,46 +1,103 @@
+import os
 import time
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from ragas.dataset_schema import SingleTurnSample
-from transformers import pipeline
+from model_registry import registry
 
 # Check if the model prediction contradicts known context using NLI
-# step 1:  Prepare hypotehsis and premis 
+# step 1:  Prepare hypotehsis and premis
 #.   premisa  --> all context text
 #.  Hypotheis : model predictions
 # step 2 : NLI classificaiton </s> special toke use to seperate sequence in RoBERT
 # labels : ENTAILMENT L. prediction is supported by context score : 1.0
 # Neutral : prediciont is neither supported not contradicted --> score 0.5
-# Contradiction prediction contradicts context 
+# Contradiction prediction contradicts context
+# step 3 : premise longer than the model window (512 tokens) --> overlapping chunks,
+#          the chunk with the highest entailment decides the label
+
+NLI_BATCH_SIZE = int(os.getenv("NLI_BATCH_SIZE", "16"))
+NLI_MAX_LENGTH = 512
+# tokens shared by neighbouring premise chunks, so a fact cut at a border is still seen whole
+NLI_CHUNK_OVERLAP = int(os.getenv("NLI_CHUNK_OVERLAP", "64"))
+# <s> premise </s></s> hypothesis </s>
+PAIR_SPECIAL_TOKENS = 4
+
+LABEL_SCORES = {"CONTRADICTION": 0.0, "NEUTRAL": 0.5, "ENTAILMENT": 1.0}
+
 
 class FactualConsistencyMetric:
 
-    def __init__(self):
-        self.nli = pipeline("text-classification", model="roberta-large-mnli")
+    def __init__(self, model_name: str = "roberta-large-mnli", batch_size: int = NLI_BATCH_SIZE,
+                 chunk_overlap: int = NLI_CHUNK_OVERLAP, variant: Optional[str] = None):
+        self.model_name = model_name
+        self.variant = variant or registry.default_variant
+        # shared with every other metric in the process, see model_registry.py
+        self.nli = registry.acquire("nli", model_name, self.variant)
+        self.batch_size = batch_size
+        self.chunk_overlap = chunk_overlap
+        # premise text -> token ids, contexts repeat across samples and adversarial variants
+        self._premise_ids: Dict[str, List[int]] = {}
+
+    def close(self):
+        registry.release("nli", self.model_name, self.variant)
+
+    def _tokens(self, text: str) -> List[int]:
+        return self.nli.tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def premise_chunks(self, premise: str, hypothesis: str) -> List[str]:
+        ids = self._premise_ids.get(premise)
+        if ids is None:
+            ids = self._premise_ids[premise] = self._tokens(premise)
+        # a hypothesis never takes more than half the window
+        hypothesis_len = min(len(self._tokens(hypothesis)), NLI_MAX_LENGTH // 2)
+        window = NLI_MAX_LENGTH - PAIR_SPECIAL_TOKENS - hypothesis_len
+        if len(ids) <= window:
+            return [premise]
+        step = max(1, window - self.chunk_overlap)
+        chunks = []
+        for start in range(0, len(ids), step):
+            chunks.append(self.nli.tokenizer.decode(ids[start:start + window]))
+            if start + window >= len(ids):
+                break
+        return chunks
+
+    def classify(self, pairs: List[Tuple[str, str]]) -> List[Dict[str, float]]:
+        """Label -> probability for each (premise, hypothesis) pair, batched.
+
+        Pairs are sent sorted by length, so each padded batch holds
+        similar lengths; results come back in input order.
+        """
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]) + len(pairs[i][1]))
+        inputs = [{"text": pairs[i][0], "text_pair": pairs[i][1]} for i in order]
+        outputs = self.nli(inputs, batch_size=self.batch_size, top_k=None, truncation=True) if inputs else []
+        probs: List[Dict[str, float]] = [{}] * len(pairs)
+        for i, out in zip(order, outputs):
+            probs[i] = {item["label"]: item["score"] for item in out}
+        return probs
 
     def score(self, samples: List[SingleTurnSample], predictions: List[str]) -> Dict[str, Any]:
-        results = []
-        for sample, pred in zip(samples, predictions):
+        pairs, owners = [], []
+        for index, (sample, pred) in enumerate(zip(samples, predictions)):
             premise = " ".join(sample.retrieved_contexts)
-            hypothesis = pred
-            res = self.nli(f"{premise} </s></s> {hypothesis}")
-            label = res[0]["label"]
+            for chunk in self.premise_chunks(premise, pred):
+                pairs.append((chunk, pred))
+                owners.append(index)
 
+        # max-entailment aggregation: the best-supporting chunk gives the label
+        best: Dict[int, Dict[str, float]] = {}
+        for index, probs in zip(owners, self.classify(pairs)):
+            if index not in best or probs.get("ENTAILMENT", 0.0) > best[index].get("ENTAILMENT", 0.0):
+                best[index] = probs
 
-            if label == "CONTRADICTION":
-               score = 0.0
-            elif label == "NEUTRAL":
-                score = 0.5
-            else:
-                score = 1.0
-            results.append(score)
+        results = []
+        for index in sorted(best):
+            label = max(best[index], key=best[index].get)
+            results.append(LABEL_SCORES.get(label, 1.0))
 
 
         return {"factual_consistency": float(np.mean(results))}
-    
+
 
     def run(self, samples: List[SingleTurnSample], predictions: List[str]) -> Dict[str, Any]:
         return self.score(samples, predictions)
-
-
-
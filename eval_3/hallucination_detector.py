@@ -1,29 +1,114 @@
+import hashlib
+import os
+import sqlite3
+import threading
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from ragas.dataset_schema import SingleTurnSample
-from sentence_transformers import SentenceTransformer, util
+from model_registry import registry
+
+# texts per encode call; MiniLM on CPU is fastest with large batches
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "128"))
+# sqlite file for embeddings across runs, empty = no cache
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "")
+
+
+class EmbeddingCache:
+    """Embeddings on disk, keyed by model name + sha256 of the text.
+
+    One connection shared by every thread (scoring runs off the thread that
+    built the detector), so each access holds the lock.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+
+    @staticmethod
+    def key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{text}".encode()).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self.lock:
+            # stay under sqlite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        rows = [(key, vec.astype(np.float32).tobytes()) for key, vec in items.items()]
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows)
+            self.db.commit()
+
 
 class HallucinationDetector:
 
-    def __init__(self):
-        self.similarity_model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, model_name: str = 'all-MiniLM-L6-v2', batch_size: int = EMBEDDING_BATCH_SIZE,
+                 cache_path: Optional[str] = EMBEDDING_CACHE_PATH, variant: Optional[str] = None):
+        self.model_name = model_name
+        self.variant = variant or registry.default_variant
+        self.batch_size = batch_size
+        # shared with every other detector in the process, see model_registry.py
+        self.similarity_model = registry.acquire("sentence-transformer", model_name, self.variant)
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+
+    def close(self):
+        registry.release("sentence-transformer", self.model_name, self.variant)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Unit-length embeddings, one row per text; each distinct text is encoded once."""
+        unique = list(dict.fromkeys(texts))
+        vectors: Dict[str, np.ndarray] = {}
+
+        keys = {}
+        if self.cache is not None:
+            # quantized variants give slightly different vectors
+            keys = {text: EmbeddingCache.key(f"{self.model_name}:{self.variant}", text) for text in unique}
+            cached = self.cache.get_many(list(keys.values()))
+            vectors = {text: cached[key] for text, key in keys.items() if key in cached}
+
+        missing = [text for text in unique if text not in vectors]
+        if missing:
+            encoded = self.similarity_model.encode(
+                missing, batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True
+            )
+            vectors.update(zip(missing, encoded))
+            if self.cache is not None:
+                self.cache.put_many({keys[text]: vec for text, vec in zip(missing, encoded)})
+
+        return np.stack([vectors[text] for text in texts]) if texts else np.zeros((0, 0), dtype=np.float32)
 
     def score(self, samples: List[SingleTurnSample], predictions: List[str]) -> Dict[str, Any]:
         halluc_scores, details = [], []
+        # zip() semantics: extra samples or predictions are ignored
+        pairs = list(zip(samples, predictions))
+        samples, predictions = [s for s, _ in pairs], [p for _, p in pairs]
+        context_texts = [" ".join(sample.retrieved_contexts) for sample in samples]
 
-        for sample, pred in zip(samples, predictions):
-            context_text = " ".join(sample.retrieved_contexts)
+        # semantic similarity: one encode for every distinct text, then row-wise cosine
+        # (embeddings are unit length, so cosine is the dot product)
+        embeddings = self.encode(context_texts + predictions)
+        ctx_emb, pred_emb = embeddings[:len(context_texts)], embeddings[len(context_texts):]
+        sims = np.einsum("ij,ij->i", pred_emb, ctx_emb) if pairs else []
 
+        ctx_token_sets = {}
+        for sample, context_text, pred, sim in zip(samples, context_texts, predictions, sims):
             # overlap
-            ctx_tokens, pred_tokens = set(context_text.split()), set(pred.split())
+            ctx_tokens = ctx_token_sets.get(context_text)
+            if ctx_tokens is None:
+                ctx_tokens = ctx_token_sets[context_text] = set(context_text.split())
+            pred_tokens = set(pred.split())
             overlap = len(pred_tokens & ctx_tokens) / max(len(pred_tokens), 1)
 
-            # semantic similarity
-            ctx_emb = self.similarity_model.encode(context_text, convert_to_tensor=True)
-            pred_emb = self.similarity_model.encode(pred, convert_to_tensor=True)
-
-            sim = util.cos_sim(pred_emb, ctx_emb).item()
-
+            sim = float(sim)
             halluc_score = 1 - (0.5 * overlap + 0.5 * sim)
             halluc_scores.append(halluc_score)
 
@@ -36,6 +121,6 @@ class HallucinationDetector:
                 "semantic": sim
             })
         return {"avg_hallucination": float(np.mean(halluc_scores)), "details": details}
-    
+
     def run(self, samples: List[SingleTurnSample], predictions: List[str]) -> Dict[str, Any]:
-        return self.score(samples, predictions)
\ No newline at end of file
+        return self.score(samples, predictions)
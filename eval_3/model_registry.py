@@ -0,0 +1,133 @@
+import os
+import resource
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# fp32 | int8 (dynamic quantization of Linear layers) | onnx (onnxruntime)
+EVAL_MODEL_VARIANT = os.getenv("EVAL_MODEL_VARIANT", "fp32")
+
+VARIANTS = ("fp32", "int8", "onnx")
+
+
+def rss_mb() -> float:
+    # current resident set; ru_maxrss (peak) where /proc is missing
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _quantize_int8(model):
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_sentence_transformer(name: str, variant: str):
+    from sentence_transformers import SentenceTransformer
+    if variant == "onnx":
+        return SentenceTransformer(name, device="cpu", backend="onnx")
+    model = SentenceTransformer(name, device="cpu")
+    return _quantize_int8(model) if variant == "int8" else model
+
+
+def load_nli(name: str, variant: str):
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+    if variant == "fp32":
+        return pipeline("text-classification", model=name)
+    if variant == "onnx":
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        model = ORTModelForSequenceClassification.from_pretrained(name, export=True)
+    else:
+        model = _quantize_int8(AutoModelForSequenceClassification.from_pretrained(name))
+    return pipeline("text-classification", model=model, tokenizer=AutoTokenizer.from_pretrained(name))
+
+
+LOADERS: Dict[str, Callable[[str, str], Any]] = {
+    "sentence-transformer": load_sentence_transformer,
+    "nli": load_nli,
+}
+
+
+class _Entry:
+    __slots__ = ("lock", "model", "refs", "load_seconds", "rss_delta_mb")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.model = None
+        self.refs = 0
+        self.load_seconds = 0.0
+        self.rss_delta_mb = 0.0
+
+
+class ModelRegistry:
+    """Process-wide heavy models, loaded on first acquire and shared.
+
+    Keyed by (kind, name, variant). Every metric or evaluator that needs a
+    model acquires it and releases it when done; the model is dropped when
+    the last reference goes. Two threads acquiring the same key wait for a
+    single load.
+    """
+
+    def __init__(self, default_variant: str = EVAL_MODEL_VARIANT):
+        if default_variant not in VARIANTS:
+            raise ValueError(f"unknown model variant {default_variant!r}, expected one of {VARIANTS}")
+        self.default_variant = default_variant
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str, str], _Entry] = {}
+
+    def _key(self, kind: str, name: str, variant: Optional[str]) -> Tuple[str, str, str]:
+        if kind not in LOADERS:
+            raise ValueError(f"unknown model kind {kind!r}, expected one of {tuple(LOADERS)}")
+        return kind, name, variant or self.default_variant
+
+    def acquire(self, kind: str, name: str, variant: Optional[str] = None):
+        key = self._key(kind, name, variant)
+        with self._lock:
+            entry = self._entries.setdefault(key, _Entry())
+            entry.refs += 1
+        with entry.lock:
+            if entry.model is None:
+                rss_before, started = rss_mb(), time.perf_counter()
+                try:
+                    entry.model = LOADERS[kind](name, key[2])
+                except BaseException:
+                    with self._lock:
+                        entry.refs -= 1
+                    raise
+                entry.load_seconds = time.perf_counter() - started
+                entry.rss_delta_mb = rss_mb() - rss_before
+        return entry.model
+
+    def release(self, kind: str, name: str, variant: Optional[str] = None):
+        key = self._key(kind, name, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.refs == 0:
+                return
+            entry.refs -= 1
+            if entry.refs == 0:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                "/".join(key): {
+                    "refs": entry.refs,
+                    "loaded": entry.model is not None,
+                    "load_seconds": round(entry.load_seconds, 3),
+                    "rss_delta_mb": round(entry.rss_delta_mb, 1),
+                }
+                for key, entry in self._entries.items()
+            }
+
+    def report(self) -> str:
+        lines = [f"{'model':55} {'refs':>4} {'load s':>8} {'rss MB':>8}"]
+        for key, s in self.stats().items():
+            lines.append(f"{key:55} {s['refs']:>4} {s['load_seconds']:>8.2f} {s['rss_delta_mb']:>8.1f}")
+        lines.append(f"process rss {rss_mb():.0f} MB")
+        return "\n".join(lines)
+
+
+registry = ModelRegistry()
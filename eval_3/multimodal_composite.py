@@ -1,12 +1,25 @@
+import os
+import queue
+import threading
 import time
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, List, Dict, Any, Optional
 import numpy as np
 
 from ragas.dataset_schema import SingleTurnSample
 from hallucination_detector import HallucinationDetector
 from factual_consistency import FactualConsistencyMetric
+from model_registry import registry
 from tiny_llama_interface import TinyLlamaInterface
 
+# generation calls in flight across all models
+EVAL_MAX_WORKERS = int(os.getenv("EVAL_MAX_WORKERS", "8"))
+# seconds a model gets for all of its samples from its first call, 0 = no limit
+EVAL_MODEL_TIMEOUT = float(os.getenv("EVAL_MODEL_TIMEOUT", "0"))
+# seconds one generation call may run before its sample counts as "Error", 0 = no limit
+EVAL_CALL_TIMEOUT = float(os.getenv("EVAL_CALL_TIMEOUT", "0"))
+
 
 class AdvanacedCompositeMetric:
 
@@ -91,21 +104,88 @@ class MultiModelEvaluator:
         self.models[name] = model_fuction
 
     
-    def compare_models(self, test_Samples: List[SingleTurnSample]) -> Dict[str, Any]:
-        results = {}
+    def compare_models(self, test_Samples: List[SingleTurnSample], max_workers: int = EVAL_MAX_WORKERS,
+                       model_timeout: float = EVAL_MODEL_TIMEOUT, call_timeout: float = EVAL_CALL_TIMEOUT,
+                       progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, Any]:
+        """Generate for every model and sample on max_workers threads.
+
+        A model is scored as soon as its last prediction is in, on a
+        separate single scoring thread, so scoring overlaps with the
+        generation of the other models. A call running longer than
+        call_timeout, and every sample a model has not answered within
+        model_timeout of its first call, count as "Error".
+        """
+        progress = progress or _print_progress
+        total = len(test_Samples)
+        predictions = {name: [None] * total for name in self.models}
+        unresolved = {name: set(range(total)) for name in self.models}
+        call_started = {}
+        model_deadline = {}
+
+        events = queue.Queue()
+        generation = _GenerationPool(max_workers, events)
+        scoring = ThreadPoolExecutor(max_workers=1, thread_name_prefix="eval-score")
+        scored = {}
+
+        def finish(model_name: str):
+            model_deadline.pop(model_name, None)
+            scored[model_name] = scoring.submit(self.composite_metrics.score, test_Samples, predictions[model_name])
+
+        def resolve(model_name: str, index: int, prediction):
+            predictions[model_name][index] = prediction
+            unresolved[model_name].discard(index)
+            call_started.pop((model_name, index), None)
+            progress(model_name, total - len(unresolved[model_name]), total)
+            if not unresolved[model_name]:
+                finish(model_name)
 
-        for model_name, model_func in self.models.items():
-            predictions = []
-            for sample in test_Samples:
+        try:
+            # sample-major order, so every model starts right away
+            for index, sample in enumerate(test_Samples):
+                for model_name, model_func in self.models.items():
+                    generation.submit((model_name, index), model_func, sample.user_input, sample.retrieved_contexts)
+            if total == 0:
+                for model_name in self.models:
+                    finish(model_name)
+
+            while any(unresolved.values()):
+                deadlines = list(model_deadline.values())
+                if call_timeout:
+                    deadlines += [started + call_timeout for started in call_started.values()]
+                timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
                 try:
-                    pred = model_func(sample.user_input, sample.retrieved_contexts)
-                    predictions.append(pred)
-                except Exception as e:
-                    print(f"Error with {model_name}: {e}")
-                    predictions.append("Error")
+                    kind, (model_name, index), value = events.get(timeout=timeout)
+                except queue.Empty:
+                    kind = None
+                if kind is not None and index in unresolved[model_name]:
+                    if kind == "start":
+                        call_started[(model_name, index)] = value
+                        if model_timeout:
+                            model_deadline.setdefault(model_name, value + model_timeout)
+                    elif isinstance(value, Exception):
+                        print(f"Error with {model_name}: {value}")
+                        resolve(model_name, index, "Error")
+                    else:
+                        resolve(model_name, index, value)
+
+                now = time.monotonic()
+                if call_timeout:
+                    for (model_name, index), started in list(call_started.items()):
+                        if now - started >= call_timeout:
+                            print(f"Timeout with {model_name}: sample {index} still running after {call_timeout}s")
+                            generation.cancel((model_name, index))
+                            resolve(model_name, index, "Error")
+                for model_name, deadline in list(model_deadline.items()):
+                    if now >= deadline:
+                        print(f"Timeout with {model_name}: {len(unresolved[model_name])} of {total} samples unanswered")
+                        for index in sorted(unresolved[model_name]):
+                            generation.cancel((model_name, index))
+                            resolve(model_name, index, "Error")
 
-            evaluation_results = self.composite_metrics.score(test_Samples, predictions)
-            results[model_name] = evaluation_results
+            results = {name: scored[name].result() for name in self.models}
+        finally:
+            generation.shutdown()
+            scoring.shutdown(wait=True)
 
         return {
             "individual_results": results,
@@ -128,9 +208,81 @@ class MultiModelEvaluator:
                          reverse=True)
     
 
+class _GenerationPool:
+    """Daemon threads running model calls, reporting ("start" | "done", key, value) on events.
+
+    A cancelled call that hasn't started is skipped. One that is running is
+    abandoned: its thread is replaced right away, so max_workers calls keep
+    going, and exits when the call returns. Daemon threads, unlike
+    ThreadPoolExecutor's, are not joined at exit, so a hung call can't keep
+    the interpreter alive.
+    """
+
+    def __init__(self, max_workers: int, events: queue.Queue):
+        self.max_workers = max_workers
+        self.events = events
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._running = set()
+        self._cancelled = set()
+        for _ in range(max_workers):
+            self._spawn()
+
+    def _spawn(self):
+        threading.Thread(target=self._work, name="eval-generate", daemon=True).start()
+
+    def submit(self, key, fn: Callable, *args):
+        self._jobs.put((key, fn, args))
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            key, fn, args = job
+            with self._lock:
+                if key in self._cancelled:
+                    continue
+                self._running.add(key)
+            self.events.put(("start", key, time.monotonic()))
+            try:
+                value = fn(*args)
+            except Exception as e:
+                value = e
+            with self._lock:
+                self._running.discard(key)
+                if key in self._cancelled:
+                    # already replaced
+                    return
+            self.events.put(("done", key, value))
+
+    def cancel(self, key):
+        with self._lock:
+            self._cancelled.add(key)
+            abandoned = key in self._running
+        if abandoned:
+            self._spawn()
+
+    def shutdown(self):
+        # queued calls are skipped or cancelled by now; abandoned ones are left to the daemon threads
+        for _ in range(self.max_workers):
+            self._jobs.put(None)
+
+
+def _print_progress(model_name: str, done: int, total: int):
+    # every 10% and at the end
+    if done == total or done % max(1, total // 10) == 0:
+        print(f"[{model_name}] {done}/{total} samples generated")
+
+
+@lru_cache(maxsize=1)
+def _tiny_llama() -> TinyLlamaInterface:
+    # one interface for every sample and thread
+    return TinyLlamaInterface()
+
+
 def tiny_llama_model(question: str, context: List[str]) -> str:
-    llama = TinyLlamaInterface()
-    out = llama.genereate_response(question, " ".join(context))
+    out = _tiny_llama().genereate_response(question, " ".join(context))
     return out["answer"] or ""
     
 
@@ -153,4 +305,5 @@ if __name__ == "__main__":
 
     results = evaluator.compare_models(test_samples)
 
-    print(results)
\ No newline at end of file
+    print(results)
+    print(registry.report())
\ No newline at end of file